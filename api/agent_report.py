@@ -1,57 +1,82 @@
 # api/agent_report.py
 
+import io
 import os
+import re
+import json
+import asyncio
 import logging
+from typing import Iterator
+
+import ahocorasick
 from dotenv import load_dotenv
-from openai import OpenAI
+from jinja2 import Environment
+from sqlalchemy import func
+import httpx
+from openai import (
+    OpenAI,
+    AsyncOpenAI,
+    APITimeoutError,
+    RateLimitError,
+    DefaultHttpxClient,
+    DefaultAsyncHttpxClient,
+)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
 from .db import SessionLocal
 from .models import Control, ChecklistItem, ArtifactChunk, Artifact
 from .retrieval import hybrid_retrieve, keyword_retrieve
+from . import prompt_cache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Max in-flight OpenAI requests when generating many reports at once.
+MAX_CONCURRENT_REPORTS = int(os.getenv("OPENAI_MAX_CONCURRENCY", "10"))
 
-def _build_prompt(control, checklist_items, artifacts_with_snippets):
-    checklist_text = (
-        "\n".join([f"- {it.text}" for it in checklist_items])
-        or "- (no checklist items found)"
-    )
+# -----------------------------------------------------------------------------
+# OpenAI clients (one per process, reusing HTTP/2 keep-alive connections)
+# -----------------------------------------------------------------------------
+_HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+_HTTP_TIMEOUT = httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "60")), connect=10.0)
+
+_client = None
+_async_client = None
 
-    evidence_blocks = []
-    for a, snippets in artifacts_with_snippets:
-        joined = "\n\n".join([f"Snippet {i+1}: {s}" for i, s in enumerate(snippets)])
-        evidence_blocks.append(
-            f"[Artifact {a.id}] name={a.name} source={a.source}\n{joined}"
+
+def _get_client() -> OpenAI:
+    """
+    Created lazily (not at import) so a missing OPENAI_API_KEY only affects
+    report generation, which then falls back.
+    """
+    global _client
+    if _client is None:
+        _client = OpenAI(
+            http_client=DefaultHttpxClient(http2=True, limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
         )
+    return _client
 
-    evidence_text = (
-        "\n\n".join(evidence_blocks)
-        if evidence_blocks
-        else "(No evidence snippets available.)"
-    )
 
-    return f"""
-You are an audit/compliance assistant. Write an SOC 2 evidence narrative for ONE control.
+def _get_async_client() -> AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        # Retries are handled by tenacity (429/timeouts), not the SDK.
+        _async_client = AsyncOpenAI(
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(http2=True, limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+        )
+    return _async_client
+
 
+_REPORT_RULES = """
 Rules:
 - Use ONLY the evidence snippets provided.
 - Do NOT invent facts. If evidence is missing, say "Missing evidence" and list what to collect.
 - Every factual claim must include a citation like [Artifact 10].
 - Output must be concise and structured.
+""".strip()
 
-Control:
-- Code: {control.code}
-- Title: {control.title}
-- Description: {control.description}
-
-Checklist (what evidence auditors expect):
-{checklist_text}
-
-Evidence snippets:
-{evidence_text}
-
+_REPORT_SECTIONS = """
 Write the report with these sections:
 1) Summary (2–4 sentences)
 2) Evidence mapped to checklist (bullet list; each bullet has citations)
@@ -59,27 +84,166 @@ Write the report with these sections:
 4) Next best actions (3 bullets)
 """.strip()
 
+# Static instructions go FIRST and are byte-identical across calls, so the
+# OpenAI prompt cache can match the shared prefix. Only the control/evidence
+# block after the separator changes per request.
+_SYSTEM_PREAMBLE = f"""
+You are an audit/compliance assistant. Write an SOC 2 evidence narrative for ONE control.
+
+{_REPORT_RULES}
+
+{_REPORT_SECTIONS}
+""".strip()
+
+_MULTI_PREAMBLE = f"""
+You are an audit/compliance assistant. Write an SOC 2 evidence narrative for EACH control in the JSON array below.
+Treat every control independently: only cite artifacts listed under that control's evidence_blocks.
+
+{_REPORT_RULES}
+
+{_REPORT_SECTIONS}
+
+Return JSON of the form {{"reports": [{{"control_id": <id>, "text": "<report>"}}]}} with exactly one report per control_id.
+""".strip()
+
+_PROMPT_SEPARATOR = prompt_cache.PROMPT_SEPARATOR
+
+# Structured output schema for the multi-control prompt: one report per control.
+_MULTI_REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reports": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "control_id": {"type": "integer"},
+                    "text": {"type": "string"},
+                },
+                "required": ["control_id", "text"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["reports"],
+    "additionalProperties": False,
+}
+
+
+# Per-control part of the prompt, compiled once at import.
+_DYNAMIC_TEMPLATE = Environment(cache_size=1, auto_reload=False, autoescape=False).from_string(
+    """
+Control:
+- Code: {{ control.code }}
+- Title: {{ control.title }}
+- Description: {{ control.description }}
+
+Checklist (what evidence auditors expect):
+{{ checklist_text }}
+
+Evidence snippets:
+{{ evidence_text }}
+"""
+)
+
+
+def _build_prompt(control, checklist_items, artifacts_with_snippets):
+    checklist_text = (
+        "\n".join(f"- {it.text}" for it in checklist_items)
+        or "- (no checklist items found)"
+    )
 
-def _pick_best_artifacts_for_item(item_text: str, artifacts_with_snippets, top_n: int = 2):
-    keywords = [
-        w.lower()
-        for w in item_text.replace("/", " ").replace("(", " ").replace(")", " ").split()
-        if len(w) >= 4
+    # Single pass into one buffer (no per-artifact intermediate lists)
+    buf = io.StringIO()
+    for n, (a, snippets) in enumerate(artifacts_with_snippets):
+        if n:
+            buf.write("\n\n")
+        buf.write(f"[Artifact {a.id}] name={a.name} source={a.source}\n")
+        for i, s in enumerate(snippets):
+            if i:
+                buf.write("\n\n")
+            buf.write(f"Snippet {i+1}: {s}")
+
+    evidence_text = buf.getvalue() or "(No evidence snippets available.)"
+
+    dynamic_block = _DYNAMIC_TEMPLATE.render(
+        control=control,
+        checklist_text=checklist_text,
+        evidence_text=evidence_text,
+    ).strip()
+
+    return _SYSTEM_PREAMBLE + _PROMPT_SEPARATOR + dynamic_block
+
+
+def _build_multi_prompt(controls_payload):
+    """
+    controls_payload: list of dicts with keys
+      control_id, control, checklist, evidence_blocks
+    The shared preamble (rules/sections) is emitted once for the whole batch.
+    """
+    payload_json = json.dumps(controls_payload, ensure_ascii=False, indent=1)
+    return _MULTI_PREAMBLE + _PROMPT_SEPARATOR + "Controls (JSON):\n" + payload_json
+
+
+def _controls_payload_entry(control, checklist_items, artifacts_with_snippets) -> dict:
+    return {
+        "control_id": control.id,
+        "control": {
+            "code": control.code,
+            "title": control.title,
+            "description": control.description,
+        },
+        "checklist": [it.text for it in checklist_items],
+        "evidence_blocks": [
+            {
+                "artifact_id": a.id,
+                "name": a.name,
+                "source": a.source,
+                "snippets": snippets,
+            }
+            for a, snippets in artifacts_with_snippets
+        ],
+    }
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _item_keywords(item_text: str) -> set:
+    return {w for w in _TOKEN_RE.findall(item_text.lower()) if len(w) >= 4}
+
+
+def _artifact_keyword_hits(artifacts_with_snippets, keywords):
+    """
+    Finds which keywords occur (as substrings) in each artifact's name and
+    snippets with one Aho-Corasick pass per haystack, instead of one scan
+    per keyword: list of (artifact_id, name_hits, text_hits).
+    """
+    if not keywords:
+        return [(a.id, set(), set()) for a, _ in artifacts_with_snippets]
+
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw, kw)
+    automaton.make_automaton()
+
+    return [
+        (
+            a.id,
+            {kw for _, kw in automaton.iter((a.name or "").lower())},
+            {kw for _, kw in automaton.iter("\n".join(snippets).lower())},
+        )
+        for a, snippets in artifacts_with_snippets
     ]
 
-    scored = []
-    for a, snippets in artifacts_with_snippets:
-        hay_name = (a.name or "").lower()
-        hay_text = "\n".join(snippets).lower()
 
-        score = 0
-        for kw in keywords:
-            if kw in hay_name:
-                score += 2
-            if kw in hay_text:
-                score += 1
+def _pick_best_artifacts_for_item(item_text: str, artifact_hits, top_n: int = 2):
+    keywords = _item_keywords(item_text)
 
-        scored.append((score, a.id))
+    scored = [
+        (2 * len(keywords & name_hits) + len(keywords & text_hits), aid)
+        for aid, name_hits, text_hits in artifact_hits
+    ]
 
     scored.sort(reverse=True)
     return [aid for score, aid in scored if score > 0][:top_n]
@@ -102,12 +266,14 @@ def _fallback_report(control, checklist_items, artifacts_with_snippets, reason:
     if not checklist_items:
         lines.append("- (No checklist items found)")
     else:
+        all_keywords = set().union(*(_item_keywords(it.text) for it in checklist_items))
+        artifact_hits = _artifact_keyword_hits(artifacts_with_snippets, all_keywords)
         for it in checklist_items:
             if not artifacts_with_snippets:
                 lines.append(f"- {it.text} — Missing evidence")
                 continue
 
-            best_ids = _pick_best_artifacts_for_item(it.text, artifacts_with_snippets, top_n=2)
+            best_ids = _pick_best_artifacts_for_item(it.text, artifact_hits, top_n=2)
             if best_ids:
                 citations = ", ".join([f"[Artifact {aid}]" for aid in best_ids])
                 lines.append(f"- {it.text} — Candidate evidence: {citations}")
@@ -155,6 +321,80 @@ def _safe_get_artifact_ids(control_id: int, k_artifacts: int) -> list[int]:
         return []
 
 
+def _query_control(db, control_id: int):
+    return db.query(Control).filter(Control.id == control_id).first()
+
+
+def _query_checklist(db, control_id: int):
+    return (
+        db.query(ChecklistItem)
+        .filter(ChecklistItem.control_id == control_id)
+        .all()
+    )
+
+
+def _load_artifacts_with_snippets(db, artifact_ids, snippets_per_artifact: int):
+    if not artifact_ids:
+        return []
+
+    artifacts = {
+        a.id: a
+        for a in db.query(Artifact).filter(Artifact.id.in_(artifact_ids)).all()
+    }
+
+    # First N chunks per artifact in one query (instead of one query per artifact)
+    rn = (
+        func.row_number()
+        .over(
+            partition_by=ArtifactChunk.artifact_id,
+            order_by=ArtifactChunk.chunk_index.asc(),
+        )
+        .label("rn")
+    )
+    ranked = (
+        db.query(ArtifactChunk.artifact_id, ArtifactChunk.text, rn)
+        .filter(ArtifactChunk.artifact_id.in_(artifact_ids))
+        .subquery()
+    )
+    snippets_by_artifact = {}
+    for artifact_id, text, _ in (
+        db.query(ranked)
+        .filter(ranked.c.rn <= snippets_per_artifact)
+        .order_by(ranked.c.artifact_id, ranked.c.rn)
+        .all()
+    ):
+        snippets_by_artifact.setdefault(artifact_id, []).append((text or "")[:1200])
+
+    # Preserve retrieval ranking order
+    return [
+        (artifacts[aid], snippets_by_artifact.get(aid, []))
+        for aid in artifact_ids
+        if aid in artifacts
+    ]
+
+
+def _load_report_context(db, control_id: int, k_artifacts: int, snippets_per_artifact: int):
+    """
+    Returns (control, checklist_items, artifacts_with_snippets),
+    or None if the control does not exist.
+    """
+    control = _query_control(db, control_id)
+    if not control:
+        return None
+
+    checklist_items = _query_checklist(db, control_id)
+    artifact_ids = _safe_get_artifact_ids(control_id, k_artifacts)
+    artifacts_with_snippets = _load_artifacts_with_snippets(db, artifact_ids, snippets_per_artifact)
+
+    return control, checklist_items, artifacts_with_snippets
+
+
+def _cacheable(status, text: str) -> bool:
+    # Only finished, non-empty answers: refusals, max-token cut-offs and
+    # failed streams would otherwise be served from the cache for days
+    return status == "completed" and bool(text.strip())
+
+
 def generate_control_report(control_id: int, k_artifacts: int = 5, snippets_per_artifact: int = 2):
     """
     Returns: (report_text, mode)
@@ -162,42 +402,24 @@ def generate_control_report(control_id: int, k_artifacts: int = 5, snippets_per_
     Never raises, so your route won't return 500.
     """
     model = os.getenv("OPENAI_MODEL", "gpt-5.2")
-    client = OpenAI()
 
     db = SessionLocal()
     try:
-        control = db.query(Control).filter(Control.id == control_id).first()
-        if not control:
+        context = _load_report_context(db, control_id, k_artifacts, snippets_per_artifact)
+        if context is None:
             return "Control not found.", "fallback"
 
-        checklist_items = (
-            db.query(ChecklistItem)
-            .filter(ChecklistItem.control_id == control_id)
-            .all()
-        )
-
-        artifact_ids = _safe_get_artifact_ids(control_id, k_artifacts)
-
-        artifacts_with_snippets = []
-        for aid in artifact_ids:
-            a = db.query(Artifact).filter(Artifact.id == aid).first()
-            if not a:
-                continue
-
-            chunks = (
-                db.query(ArtifactChunk)
-                .filter(ArtifactChunk.artifact_id == aid)
-                .order_by(ArtifactChunk.chunk_index.asc())
-                .limit(snippets_per_artifact)
-                .all()
-            )
-            snippets = [(c.text or "")[:1200] for c in chunks]
-            artifacts_with_snippets.append((a, snippets))
-
+        control, checklist_items, artifacts_with_snippets = context
         prompt = _build_prompt(control, checklist_items, artifacts_with_snippets)
 
+        cached = prompt_cache.lookup(prompt, model, control_id)
+        if cached is not None:
+            return cached, "openai"
+
         try:
-            resp = client.responses.create(model=model, input=prompt)
+            resp = _get_client().responses.create(model=model, input=prompt)
+            if _cacheable(resp.status, resp.output_text):
+                prompt_cache.store(prompt, resp.output_text, model, control_id)
             return resp.output_text, "openai"
         except Exception as e:
             logger.exception("OpenAI report generation failed: %s", str(e))
@@ -208,3 +430,222 @@ def generate_control_report(control_id: int, k_artifacts: int = 5, snippets_per_
         return "Agent report failed unexpectedly. Try again after uploading evidence.", "fallback"
     finally:
         db.close()
+
+
+def stream_control_report(control_id: int, k_artifacts: int = 5, snippets_per_artifact: int = 2) -> Iterator[str]:
+    """
+    Streaming variant for the interactive UI: yields report text deltas as
+    the model produces them. Never raises; if the stream fails part-way,
+    the deterministic fallback report is appended as the tail.
+    """
+    model = os.getenv("OPENAI_MODEL", "gpt-5.2")
+
+    db = SessionLocal()
+    try:
+        context = _load_report_context(db, control_id, k_artifacts, snippets_per_artifact)
+    except Exception as e:
+        logger.exception("stream_control_report unexpected error: %s", str(e))
+        yield "Agent report failed unexpectedly. Try again after uploading evidence."
+        return
+    finally:
+        db.close()
+
+    if context is None:
+        yield "Control not found."
+        return
+
+    control, checklist_items, artifacts_with_snippets = context
+    prompt = _build_prompt(control, checklist_items, artifacts_with_snippets)
+
+    cached = prompt_cache.lookup(prompt, model, control_id)
+    if cached is not None:
+        yield cached
+        return
+
+    parts, status = [], None
+    try:
+        with _get_client().responses.stream(model=model, input=prompt) as stream:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    parts.append(event.delta)
+                    yield event.delta
+                elif event.type in ("response.completed", "response.incomplete", "response.failed"):
+                    # Terminal event; get_final_response() raises unless completed
+                    status = event.response.status
+        text = "".join(parts)
+        if _cacheable(status, text):
+            prompt_cache.store(prompt, text, model, control_id)
+    except Exception as e:
+        logger.exception("OpenAI report streaming failed: %s", str(e))
+        tail = _fallback_report(control, checklist_items, artifacts_with_snippets, reason=str(e))
+        yield ("\n\n" + tail) if parts else tail
+
+
+def generate_control_reports(control_ids, k_artifacts: int = 5, snippets_per_artifact: int = 2):
+    """
+    Batched variant of generate_control_report: packs every control into ONE
+    Responses API call with a structured JSON output (one report per control).
+
+    Returns: {control_id: (report_text, mode)}
+    Never raises; controls missing from the model output get the fallback report.
+    """
+    model = os.getenv("OPENAI_MODEL", "gpt-5.2")
+    results = {}
+
+    db = SessionLocal()
+    try:
+        contexts = {}
+        for cid in dict.fromkeys(control_ids):
+            context = _load_report_context(db, cid, k_artifacts, snippets_per_artifact)
+            if context is None:
+                results[cid] = ("Control not found.", "fallback")
+            else:
+                contexts[cid] = context
+
+        if not contexts:
+            return results
+
+        payload = [_controls_payload_entry(*ctx) for ctx in contexts.values()]
+        prompt = _build_multi_prompt(payload)
+
+        reason = ""
+        texts = {}
+        try:
+            resp = _get_client().responses.create(
+                model=model,
+                input=prompt,
+                text={
+                    "format": {
+                        "type": "json_schema",
+                        "name": "control_reports",
+                        "schema": _MULTI_REPORT_SCHEMA,
+                        "strict": True,
+                    }
+                },
+            )
+            parsed = json.loads(resp.output_text)
+            texts = {int(r["control_id"]): r["text"] for r in parsed.get("reports", [])}
+        except Exception as e:
+            logger.exception("OpenAI batched report generation failed: %s", str(e))
+            reason = str(e)
+
+        for cid, (control, checklist_items, artifacts_with_snippets) in contexts.items():
+            text = texts.get(cid)
+            if text:
+                results[cid] = (text, "openai")
+            else:
+                results[cid] = (
+                    _fallback_report(
+                        control,
+                        checklist_items,
+                        artifacts_with_snippets,
+                        reason=reason or "No report returned for this control in the batched response.",
+                    ),
+                    "fallback",
+                )
+        return results
+
+    except Exception as e:
+        logger.exception("generate_control_reports unexpected error: %s", str(e))
+        msg = "Agent report failed unexpectedly. Try again after uploading evidence."
+        return {cid: results.get(cid, (msg, "fallback")) for cid in control_ids}
+    finally:
+        db.close()
+
+
+def _in_session(fn, *args):
+    # Fresh session per worker thread; sessions are not thread-safe.
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def _aload_report_context(control_id: int, k_artifacts: int, snippets_per_artifact: int):
+    """
+    Async version of _load_report_context: the control, checklist and
+    retrieval lookups are independent, so they run concurrently in worker
+    threads. Only the snippet fetch waits for the retrieved artifact ids.
+    """
+    control, checklist_items, artifact_ids = await asyncio.gather(
+        asyncio.to_thread(_in_session, _query_control, control_id),
+        asyncio.to_thread(_in_session, _query_checklist, control_id),
+        asyncio.to_thread(_safe_get_artifact_ids, control_id, k_artifacts),
+    )
+    if not control:
+        return None
+
+    artifacts_with_snippets = await asyncio.to_thread(
+        _in_session, _load_artifacts_with_snippets, artifact_ids, snippets_per_artifact
+    )
+    return control, checklist_items, artifacts_with_snippets
+
+
+@retry(
+    retry=retry_if_exception_type((RateLimitError, APITimeoutError)),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def _acreate_response(client: AsyncOpenAI, model: str, prompt: str):
+    return await client.responses.create(model=model, input=prompt)
+
+
+async def agenerate_control_report(
+    control_id: int,
+    k_artifacts: int = 5,
+    snippets_per_artifact: int = 2,
+    semaphore: asyncio.Semaphore | None = None,
+):
+    """
+    Async variant of generate_control_report.
+    Returns: (report_text, mode). Never raises.
+
+    If a semaphore is given, the OpenAI call is made while holding it, which
+    bounds concurrency when many reports are generated together.
+    """
+    model = os.getenv("OPENAI_MODEL", "gpt-5.2")
+
+    try:
+        context = await _aload_report_context(control_id, k_artifacts, snippets_per_artifact)
+    except Exception as e:
+        logger.exception("agenerate_control_report unexpected error: %s", str(e))
+        return "Agent report failed unexpectedly. Try again after uploading evidence.", "fallback"
+
+    if context is None:
+        return "Control not found.", "fallback"
+
+    control, checklist_items, artifacts_with_snippets = context
+    prompt = _build_prompt(control, checklist_items, artifacts_with_snippets)
+
+    cached = await asyncio.to_thread(prompt_cache.lookup, prompt, model, control_id)
+    if cached is not None:
+        return cached, "openai"
+
+    try:
+        client = _get_async_client()
+        if semaphore is None:
+            resp = await _acreate_response(client, model, prompt)
+        else:
+            async with semaphore:
+                resp = await _acreate_response(client, model, prompt)
+        if _cacheable(resp.status, resp.output_text):
+            await asyncio.to_thread(prompt_cache.store, prompt, resp.output_text, model, control_id)
+        return resp.output_text, "openai"
+    except Exception as e:
+        logger.exception("OpenAI report generation failed: %s", str(e))
+        return _fallback_report(control, checklist_items, artifacts_with_snippets, reason=str(e)), "fallback"
+
+
+async def generate_many(control_ids, concurrency: int = MAX_CONCURRENT_REPORTS, **kwargs):
+    """
+    Generates reports for many controls concurrently (at most `concurrency`
+    OpenAI requests in flight). Returns {control_id: (report_text, mode)}.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    control_ids = list(dict.fromkeys(control_ids))
+    results = await asyncio.gather(
+        *(agenerate_control_report(cid, semaphore=semaphore, **kwargs) for cid in control_ids)
+    )
+    return dict(zip(control_ids, results))
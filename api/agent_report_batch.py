@@ -0,0 +1,192 @@
+# api/agent_report_batch.py
+#
+# Offline/bulk report generation through the OpenAI Batch API.
+# Batch jobs are billed at a discount and use a separate rate-limit pool,
+# so nightly runs across all controls go here. Single-control UI flows keep
+# using the synchronous path in agent_report.py.
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from .db import SessionLocal
+from .models import Control, AgentRun, ReportBatch
+from .agent_report import _build_prompt, _get_client, _load_report_context
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/responses"
+COMPLETION_WINDOW = "24h"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _build_batch_jsonl(requests) -> bytes:
+    return "\n".join(json.dumps(r, ensure_ascii=False) for r in requests).encode("utf-8")
+
+
+def _output_text_from_body(body: dict) -> str:
+    """
+    Batch output lines carry the raw Responses API JSON (no SDK helpers),
+    so collect output_text parts by hand.
+    """
+    parts = []
+    for item in body.get("output", []) or []:
+        if item.get("type") != "message":
+            continue
+        for content in item.get("content", []) or []:
+            if content.get("type") == "output_text":
+                parts.append(content.get("text", ""))
+    return "".join(parts)
+
+
+def submit_reports_batch(control_ids=None, k_artifacts: int = 5, snippets_per_artifact: int = 2) -> str:
+    """
+    Builds one /v1/responses request per control, uploads them as a JSONL
+    batch input file and creates the batch. Returns the OpenAI batch id.
+    If control_ids is None, every control is included.
+    """
+    model = os.getenv("OPENAI_MODEL", "gpt-5.2")
+    client = _get_client()
+
+    db = SessionLocal()
+    try:
+        if control_ids is None:
+            control_ids = [cid for (cid,) in db.query(Control.id).order_by(Control.id).all()]
+
+        requests = []
+        included = []
+        for cid in control_ids:
+            context = _load_report_context(db, cid, k_artifacts, snippets_per_artifact)
+            if context is None:
+                logger.warning("Skipping unknown control_id=%s in report batch", cid)
+                continue
+
+            requests.append(
+                {
+                    "custom_id": str(cid),
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {"model": model, "input": _build_prompt(*context)},
+                }
+            )
+            included.append(cid)
+
+        if not requests:
+            raise ValueError("No valid controls to submit.")
+
+        input_file = client.files.create(
+            file=("control_reports.jsonl", io.BytesIO(_build_batch_jsonl(requests))),
+            purpose="batch",
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+        )
+
+        db.add(
+            ReportBatch(
+                openai_batch_id=batch.id,
+                status=batch.status,
+                control_ids=",".join(str(cid) for cid in included),
+                input_file_id=input_file.id,
+            )
+        )
+        db.commit()
+        return batch.id
+    finally:
+        db.close()
+
+
+def collect_reports_batch(batch_id: str, wait: bool = False, poll_interval: int = 60) -> str:
+    """
+    Polls the batch; once completed, downloads the output file and stores
+    one AgentRun row per control (status done/failed, report text in notes).
+    Returns the latest batch status ("collected" once results are stored).
+    """
+    client = _get_client()
+
+    db = SessionLocal()
+    try:
+        record = db.query(ReportBatch).filter(ReportBatch.openai_batch_id == batch_id).first()
+        if not record:
+            raise ValueError(f"Unknown report batch: {batch_id}")
+        if record.status == "collected":
+            return record.status
+
+        while True:
+            batch = client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES or not wait:
+                break
+            time.sleep(poll_interval)
+
+        record.status = batch.status
+        record.output_file_id = batch.output_file_id
+
+        if batch.status != "completed" or not batch.output_file_id:
+            db.commit()
+            return record.status
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        output = client.files.content(batch.output_file_id).text
+
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            control_id = int(result["custom_id"])
+            response = result.get("response") or {}
+            body = response.get("body") or {}
+
+            if result.get("error") or response.get("status_code") != 200:
+                status, notes = "failed", json.dumps(result.get("error") or body)
+            else:
+                status, notes = "done", _output_text_from_body(body)
+
+            db.add(
+                AgentRun(
+                    control_id=control_id,
+                    status=status,
+                    notes=notes,
+                    started_at=record.created_at,
+                    finished_at=now,
+                )
+            )
+
+        record.status = "collected"
+        record.collected_at = now
+        db.commit()
+        return record.status
+    finally:
+        db.close()
+
+
+def main() -> None:
+    # python -m api.agent_report_batch submit [control_id ...]
+    # python -m api.agent_report_batch collect <batch_id> [--wait]
+    args = sys.argv[1:]
+    if not args or args[0] not in ("submit", "collect"):
+        print("Usage: python -m api.agent_report_batch submit [control_id ...] | collect <batch_id> [--wait]")
+        return
+
+    if args[0] == "submit":
+        control_ids = [int(a) for a in args[1:]] or None
+        batch_id = submit_reports_batch(control_ids)
+        print(f"Submitted report batch: {batch_id}")
+    else:
+        if len(args) < 2:
+            print("collect requires a batch id")
+            return
+        status = collect_reports_batch(args[1], wait="--wait" in args[2:])
+        print(f"Report batch {args[1]}: {status}")
+
+
+if __name__ == "__main__":
+    main()
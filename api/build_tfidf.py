@@ -0,0 +1,32 @@
+# api/build_tfidf.py
+#
+# Fits the TF-IDF keyword index over all artifact chunks and writes it to
+# TFIDF_SNAPSHOT_PATH (default models/tfidf.joblib). retrieval.py loads the
+# snapshot at import and keeps using it until artifact_chunks changes.
+#
+#   python -m api.build_tfidf
+
+import os
+
+import joblib
+
+from .db import SessionLocal
+from .retrieval import TFIDF_SNAPSHOT_PATH, build_tfidf_index
+
+
+def main() -> None:
+    db = SessionLocal()
+    try:
+        index = build_tfidf_index(db)
+    finally:
+        db.close()
+
+    os.makedirs(os.path.dirname(TFIDF_SNAPSHOT_PATH) or ".", exist_ok=True)
+    joblib.dump(index, TFIDF_SNAPSHOT_PATH)
+
+    max_id, count = index["key"]
+    print(f"TF-IDF snapshot written to {TFIDF_SNAPSHOT_PATH} ({count} chunks, max id {max_id})")
+
+
+if __name__ == "__main__":
+    main()
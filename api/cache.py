@@ -0,0 +1,64 @@
+# api/cache.py
+#
+# Tiny in-process cache for read-mostly page data.
+# Entries expire after a TTL, and invalidate() bumps a version counter so
+# writers in the same process can drop stale data immediately. Other
+# instances (Cloud Run) pick up changes once the TTL runs out.
+
+import time
+import threading
+
+
+class VersionedTTLCache:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._lock = threading.Lock()
+        self._value = None
+        self._value_version = None
+        self._expires_at = 0.0
+
+    def _lookup(self):
+        # (hit, value, version the caller should load for)
+        now = time.monotonic()
+        with self._lock:
+            if self._value_version == self.version and now < self._expires_at:
+                return True, self._value, self.version
+            return False, None, self.version
+
+    def _store(self, version, value, loaded_at: float) -> None:
+        with self._lock:
+            # Don't overwrite with data loaded before a concurrent invalidate()
+            if version == self.version:
+                self._value = value
+                self._value_version = version
+                self._expires_at = loaded_at + self.ttl_seconds
+
+    def get(self, loader):
+        """
+        Returns the cached value, or calls loader() to rebuild it when the
+        entry is missing, expired or invalidated.
+        """
+        hit, value, version = self._lookup()
+        if hit:
+            return value
+
+        loaded_at = time.monotonic()
+        value = loader()
+        self._store(version, value, loaded_at)
+        return value
+
+    async def aget(self, loader):
+        """Same as get(), for an async loader (awaited on a miss)."""
+        hit, value, version = self._lookup()
+        if hit:
+            return value
+
+        loaded_at = time.monotonic()
+        value = await loader()
+        self._store(version, value, loaded_at)
+        return value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.version += 1
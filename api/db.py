@@ -1,7 +1,9 @@
 # api/db.py
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 Base = declarative_base()
@@ -31,7 +33,31 @@ def _build_database_url() -> str:
     return "sqlite:///./app.db"
 
 
+def _build_async_database_url(url: str) -> str:
+    """
+    Same database through an asyncio driver: asyncpg for Postgres,
+    aiosqlite for local SQLite.
+    """
+    scheme, rest = url.split("://", 1)
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme.startswith("postgresql"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
 DATABASE_URL = _build_database_url()
+ASYNC_DATABASE_URL = _build_async_database_url(DATABASE_URL)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL + NORMAL sync: readers don't block on the writer and commits skip most fsyncs (dev only)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
 
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
@@ -39,12 +65,50 @@ if DATABASE_URL.startswith("sqlite"):
         connect_args={"check_same_thread": False},
         pool_pre_ping=True,
     )
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 else:
     # Postgres (Cloud SQL)
+    # Sized per instance. Worst case per instance is sync (5 + 10) + async (3 + 5) = 23
+    # connections; keep 23 x max instances under Cloud SQL's max_connections
+    # (raise DB_* on larger tiers, see README)
     engine = create_engine(
         DATABASE_URL,
         pool_pre_ping=True,
-        connect_args={"connect_timeout": 10},  # avoids hanging startup
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_recycle=1800,  # recycle before Cloud SQL drops idle connections
+        pool_use_lifo=True,  # reuse the most recently returned (warm) connection
+        connect_args={
+            "connect_timeout": 10,  # avoids hanging startup
+            "options": "-c statement_timeout=15000",
+        },
     )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # Async handlers get their own (smaller) pool; both count against Cloud SQL's connection limit
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_size=int(os.getenv("DB_ASYNC_POOL_SIZE", "3")),
+        max_overflow=int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "5")),
+        pool_recycle=1800,
+        pool_use_lifo=True,
+        connect_args={
+            "timeout": 10,
+            "server_settings": {"statement_timeout": "15000"},
+        },
+    )
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def insert_ignore(model):
+    """
+    INSERT ... ON CONFLICT DO NOTHING for the configured database, so callers
+    can lean on unique constraints instead of a SELECT-then-INSERT.
+    """
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
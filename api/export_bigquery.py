@@ -1,14 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
 from google.cloud import bigquery
 
 from .db import SessionLocal
-from .models import Control, ControlScore, Gap
+from .models import Control, ControlScore, Gap, ExportWatermark
 
 PROJECT_ID = "auditreadinessai"
 BQ_DATASET = "auditreadiness"
 BQ_TABLE_SCORES = "control_scores"
 BQ_TABLE_GAPS = "gaps"
 
+# Rows per BigQuery load job
+LOAD_BATCH_SIZE = 5000
+
 def get_max_id(client: bigquery.Client, table_id: str, id_field: str) -> int:
     query = f"SELECT MAX({id_field}) AS max_id FROM `{table_id}`"
     result = client.query(query).result()
@@ -16,6 +20,25 @@ def get_max_id(client: bigquery.Client, table_id: str, id_field: str) -> int:
         return int(row["max_id"] or 0)
     return 0
 
+def get_watermark(db, client: bigquery.Client, table_id: str, id_field: str) -> int:
+    """
+    Last exported id, from the local export_watermarks table.
+    Falls back to MAX(id) in BigQuery only on cold start (no watermark row yet).
+    """
+    wm = db.get(ExportWatermark, table_id)
+    if wm is not None:
+        return wm.last_id
+    return get_max_id(client, table_id, id_field)
+
+def save_watermark(table_id: str, last_id: int) -> None:
+    # Own session: the export session is still streaming rows (yield_per)
+    db = SessionLocal()
+    try:
+        db.merge(ExportWatermark(table_name=table_id, last_id=last_id))
+        db.commit()
+    finally:
+        db.close()
+
 def to_utc_iso(dt):
     if dt is None:
         return None
@@ -23,86 +46,119 @@ def to_utc_iso(dt):
         dt = dt.replace(tzinfo=timezone.utc)
     return dt.astimezone(timezone.utc).isoformat()
 
+def _load_in_batches(client: bigquery.Client, table_id: str, rows, id_field: str) -> int:
+    """
+    Appends rows to table_id with batch load jobs of LOAD_BATCH_SIZE rows
+    (cheaper than streaming inserts), advancing the export watermark after
+    each successful job. Rows must be ordered by id_field.
+    Returns the number of rows loaded.
+    """
+    job_config = bigquery.LoadJobConfig(
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+    )
+
+    def load(buf):
+        client.load_table_from_json(buf, table_id, job_config=job_config).result()
+        save_watermark(table_id, buf[-1][id_field])
+        return len(buf)
+
+    loaded = 0
+    buf = []
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= LOAD_BATCH_SIZE:
+            loaded += load(buf)
+            buf = []
+
+    if buf:
+        loaded += load(buf)
+
+    return loaded
+
 
 def export_scores(client: bigquery.Client):
     table_id = f"{PROJECT_ID}.{BQ_DATASET}.{BQ_TABLE_SCORES}"
-    max_score_id = get_max_id(client, table_id, "score_id")
 
     db = SessionLocal()
     try:
-        scores = db.query(ControlScore).filter(ControlScore.id > max_score_id).all()
-        rows = []
-
-        for s in scores:
-            c = db.query(Control).filter(Control.id == s.control_id).first()
-            if not c:
-                continue
-
-            rows.append(
-                {
-                    "score_id": s.id,
-                    "control_id": c.id,
-                    "control_code": c.code,
-                    "control_title": c.title,
-                    "category": c.category,
-                    "coverage_pct": float(s.coverage_pct),
-                    "freshness_score": float(s.freshness_score),
-                    "source_credibility": float(s.source_credibility),
-                    "readiness_score": float(s.readiness_score),
-                    "computed_at": to_utc_iso(s.computed_at),
-                }
-            )
-
-        if not rows:
+        max_score_id = get_watermark(db, client, table_id, "score_id")
+        q = (
+            db.query(ControlScore, Control)
+            .join(Control, Control.id == ControlScore.control_id)
+            .filter(ControlScore.id > max_score_id)
+            .order_by(ControlScore.id)
+            .yield_per(1000)
+        )
+        rows = (
+            {
+                "score_id": s.id,
+                "control_id": c.id,
+                "control_code": c.code,
+                "control_title": c.title,
+                "category": c.category,
+                "coverage_pct": float(s.coverage_pct),
+                "freshness_score": float(s.freshness_score),
+                "source_credibility": float(s.source_credibility),
+                "readiness_score": float(s.readiness_score),
+                "computed_at": to_utc_iso(s.computed_at),
+            }
+            for s, c in q
+        )
+
+        exported = _load_in_batches(client, table_id, rows, "score_id")
+        if not exported:
             print(f"No new ControlScore rows to export. (max_score_id={max_score_id})")
             return
 
-        errors = client.insert_rows_json(table_id, rows)
-        print("Errors:", errors if errors else "None")
-        print(f"Exported {len(rows)} NEW rows to {table_id}")
+        print(f"Exported {exported} NEW rows to {table_id}")
     finally:
         db.close()
 
 def export_gaps(client: bigquery.Client):
     table_id = f"{PROJECT_ID}.{BQ_DATASET}.{BQ_TABLE_GAPS}"
-    max_gap_id = get_max_id(client, table_id, "gap_id")
 
     db = SessionLocal()
     try:
-        gaps = db.query(Gap).filter(Gap.id > max_gap_id).all()
-        rows = []
-
-        for g in gaps:
-            c = db.query(Control).filter(Control.id == g.control_id).first()
-            if not c:
-                continue
-
-            rows.append(
-                {
-                    "gap_id": g.id,
-                    "control_id": c.id,
-                    "control_code": c.code,
-                    "severity": g.severity,
-                    "reason": g.reason,
-                    "created_at": to_utc_iso(g.created_at),
-                    "resolved_at": to_utc_iso(g.resolved_at),
-                }
-            )
-
-        if not rows:
+        max_gap_id = get_watermark(db, client, table_id, "gap_id")
+        q = (
+            db.query(Gap, Control)
+            .join(Control, Control.id == Gap.control_id)
+            .filter(Gap.id > max_gap_id)
+            .order_by(Gap.id)
+            .yield_per(1000)
+        )
+        rows = (
+            {
+                "gap_id": g.id,
+                "control_id": c.id,
+                "control_code": c.code,
+                "severity": g.severity,
+                "reason": g.reason,
+                "created_at": to_utc_iso(g.created_at),
+                "resolved_at": to_utc_iso(g.resolved_at),
+            }
+            for g, c in q
+        )
+
+        exported = _load_in_batches(client, table_id, rows, "gap_id")
+        if not exported:
             print(f"No new Gap rows to export. (max_gap_id={max_gap_id})")
             return
 
-        errors = client.insert_rows_json(table_id, rows)
-        print("Errors:", errors if errors else "None")
-        print(f"Exported {len(rows)} NEW rows to {table_id}")
+        print(f"Exported {exported} NEW rows to {table_id}")
     finally:
         db.close()
 
 def main():
     client = bigquery.Client(project=PROJECT_ID)
-    export_scores(client)
-    export_gaps(client)
+
+    # Independent exports (own DB sessions); overlap their BigQuery RPCs.
+    # bigquery.Client is safe to share across threads.
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [ex.submit(export_scores, client), ex.submit(export_gaps, client)]
+        for f in futures:
+            f.result()
 
 
 if __name__ == "__main__":
@@ -1,30 +1,102 @@
 import os
+import re
+import mmap
+from typing import Iterable, Iterator
+
+# Uploads above this size are chunked straight from an mmap
+MMAP_THRESHOLD = 1 << 20
+
+_TEXT_EXTS = frozenset({".txt", ".md", ".csv", ".json", ".log"})
+
 
 def read_text_from_file(path: str) -> str:
     ext = os.path.splitext(path)[1].lower()
 
     # For MVP: only reliably index text-based files
-    if ext in [".txt", ".md", ".csv", ".json", ".log"]:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
+    if ext in _TEXT_EXTS:
+        with open(path, "rb") as f:
+            return f.read().decode("utf-8", "ignore")
 
     # PDFs/images: skip for now (later we’ll add PDF parsing/OCR)
     return ""
 
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
 def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150):
-    text = " ".join(text.split())  # normalize whitespace
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    text = _WHITESPACE_RE.sub(" ", text).strip()  # normalize whitespace
     if not text:
         return []
 
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(len(text), start + chunk_size)
-        chunks.append(text[start:end])
-        start = end - overlap
-        if start < 0:
-            start = 0
-        if end == len(text):
-            break
-    return chunks
+    # Windows start every `step` chars; the last one is the first that reaches the end.
+    step = chunk_size - overlap
+    starts = range(0, max(1, len(text) - overlap), step)
+    return [text[s:s + chunk_size] for s in starts]
+
+
+_WORD_RE = re.compile(rb"\S+")
+
+
+def _iter_window_chunks(pieces: Iterable[str], chunk_size: int, overlap: int) -> Iterator[str]:
+    """
+    Streaming equivalent of chunk_text over already-normalized text pieces:
+    only about one chunk of text is held in memory at a time.
+    """
+    step = chunk_size - overlap
+    buf = ""
+    parts, size = [], 0
+    for piece in pieces:
+        parts.append(piece)
+        size += len(piece)
+        if len(buf) + size <= chunk_size:
+            continue
+
+        buf += "".join(parts)
+        parts, size = [], 0
+        while len(buf) > chunk_size:
+            yield buf[:chunk_size]
+            buf = buf[step:]
+
+    buf += "".join(parts)
+    if buf:
+        yield buf
+
+
+def _iter_mmap_words(mm) -> Iterator[str]:
+    first = True
+    for m in _WORD_RE.finditer(mm):
+        # Bytes \S+ only splits on ASCII whitespace; split the decoded token
+        # again so NBSP etc. normalize exactly like chunk_text's \s+
+        for word in m.group().decode("utf-8", "ignore").split():
+            yield word if first else " " + word
+            first = False
+
+
+def chunk_file(path: str, chunk_size: int = 800, overlap: int = 150) -> Iterator[str]:
+    """
+    Yields the same chunks as chunk_text() over the whole file decoded as
+    UTF-8 (invalid bytes dropped), whatever its extension - uploads have
+    always been indexed that way.
+    Large files are scanned through a read-only mmap instead of being
+    read (and whitespace-normalized) into one big string.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    size = os.path.getsize(path)
+    if size < MMAP_THRESHOLD:
+        with open(path, "rb") as f:
+            text = f.read().decode("utf-8", "ignore")
+        yield from chunk_text(text, chunk_size, overlap)
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            yield from _iter_window_chunks(_iter_mmap_words(mm), chunk_size, overlap)
+    finally:
+        os.close(fd)
@@ -1,15 +1,30 @@
 # api/main.py
 from google.cloud import storage
 import os
+import asyncio
+import time
+import hashlib
+import logging
 import traceback
+from contextlib import suppress
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import islice
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+import aiofiles
+
+from fastapi import FastAPI, Request, UploadFile, File, Form, Depends, BackgroundTasks
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+from sqlalchemy import exc, func, case, inspect, insert, literal, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
-from .db import SessionLocal, engine, Base
+from .db import SessionLocal, AsyncSessionLocal, engine, Base, insert_ignore
 from .models import (
     Control,
     Artifact,
@@ -18,9 +33,12 @@ from .models import (
     ControlScore,
     Gap,
     ArtifactChunk,
+    SchemaMeta,
 )
-from .indexing import read_text_from_file, chunk_text
-from .agent_report import generate_control_report
+from .indexing import chunk_file
+from .agent_report import agenerate_control_report, stream_control_report
+from .retrieval import encode_chunk_texts, hybrid_enabled
+from .cache import VersionedTTLCache
 from .seed import seed_controls, seed_checklist_items  # <-- make sure api/seed.py exists
 
 
@@ -28,18 +46,127 @@ from .seed import seed_controls, seed_checklist_items  # <-- make sure api/seed.
 # App + Startup Setup
 # ----------------------------
 app = FastAPI(title="AuditReadinessAI")
+logger = logging.getLogger(__name__)
+
+
+def get_db():
+    """Request-scoped session, closed after the response is sent."""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """Request-scoped AsyncSession for async def handlers (DB I/O doesn't block the event loop)."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Controls only change via seeding, so the home page list is served from memory.
+controls_cache = VersionedTTLCache(ttl_seconds=60)
+
+# Artifact list: invalidated on upload here; other instances catch up within the TTL.
+artifacts_cache = VersionedTTLCache(ttl_seconds=30)
+
+
+# Bump whenever ADDED_COLUMNS/ADDED_INDEXES change: databases at an older
+# version run _upgrade_schema once at the next startup, current ones skip it.
+SCHEMA_VERSION = 2
+
+# Columns/indexes added after a table was first created; create_all never alters existing tables.
+ADDED_COLUMNS = {
+    "artifacts": ("content_sha",),
+    "artifact_chunks": ("embedding",),
+    "prompt_cache": ("control_id", "model"),
+}
+ADDED_INDEXES = {
+    "agent_runs": ("ix_agent_runs_control_id",),
+    "artifact_chunks": ("ix_chunk_artifact_index",),
+    "checklist_items": ("ix_checklist_items_control_id",),
+    "control_artifact_links": ("ix_link_control_artifact", "ix_control_artifact_links_artifact_id"),
+    "control_scores": ("ix_controlscore_control_computed",),
+    "gaps": ("ix_gap_control_unresolved",),
+}
+
+
+def _delete_duplicates(conn, table, index) -> None:
+    # Rows written before a unique index existed: keep the oldest of each group
+    keep = select(func.min(table.c.id)).group_by(*index.columns).scalar_subquery()
+    deleted = conn.execute(table.delete().where(table.c.id.not_in(keep))).rowcount
+    if deleted:
+        print(f"✅ Removed {deleted} duplicate rows from {table.name} for {index.name}")
+
+
+def _upgrade_schema(inspector) -> None:
+    with engine.begin() as conn:
+        for table_name, column_names in ADDED_COLUMNS.items():
+            table = Base.metadata.tables[table_name]
+            present = {c["name"] for c in inspector.get_columns(table_name)}
+            for name in column_names:
+                if name in present:
+                    continue
+                column_type = table.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+                for index in table.indexes:
+                    if name in index.columns:
+                        index.create(conn, checkfirst=True)
+                print(f"✅ Added column {table_name}.{name}")
+
+        for table_name, index_names in ADDED_INDEXES.items():
+            table = Base.metadata.tables[table_name]
+            present = {ix["name"] for ix in inspector.get_indexes(table_name)}
+            for index in table.indexes:
+                if index.name not in index_names or index.name in present:
+                    continue
+                try:
+                    # Savepoint: a failed CREATE must not abort the rest of the upgrade
+                    with conn.begin_nested():
+                        if index.unique:
+                            _delete_duplicates(conn, table, index)
+                        index.create(conn)
+                    print(f"✅ Added index {index.name}")
+                except Exception:
+                    print(f"❌ Could not create index {index.name} (not retried until SCHEMA_VERSION changes):")
+                    traceback.print_exc()
+
+
+def _schema_version():
+    """Version recorded in schema_meta, or None on a fresh / pre-versioning database."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(SchemaMeta.version).where(SchemaMeta.id == 1)).scalar()
+    except exc.DBAPIError:
+        return None  # schema_meta doesn't exist yet
+
+
+def _record_schema_version() -> None:
+    with engine.begin() as conn:
+        conn.execute(SchemaMeta.__table__.delete())
+        conn.execute(insert(SchemaMeta).values(id=1, version=SCHEMA_VERSION))
 
 
 @app.on_event("startup")
 def startup():
     """
     Cloud Run + Cloud SQL safe startup:
-    - Create tables when the app starts (not at import time)
+    - Skip schema work when schema_meta already records SCHEMA_VERSION (one SELECT)
+    - Otherwise create missing tables and add columns/indexes introduced since
+      the tables were created, then record the version
     - Seed controls/checklist only if empty
     - Print real traceback to logs if DB init fails
     """
     try:
-        Base.metadata.create_all(bind=engine)
+        # Warm databases: one SELECT instead of introspecting every table
+        if _schema_version() != SCHEMA_VERSION:
+            inspector = inspect(engine)
+            existing = set(inspector.get_table_names())
+            if not set(Base.metadata.tables).issubset(existing):
+                Base.metadata.create_all(bind=engine)
+            _upgrade_schema(inspector)
+            _record_schema_version()
+            print(f"✅ Schema at version {SCHEMA_VERSION}.")
 
         db = SessionLocal()
         try:
@@ -47,6 +174,7 @@ def startup():
             if db.query(Control).count() == 0:
                 seed_controls(db)
                 seed_checklist_items(db)
+                controls_cache.invalidate()
                 print("✅ Seeded controls + checklist (fresh database).")
             else:
                 print("✅ DB already seeded (controls exist).")
@@ -61,14 +189,39 @@ def startup():
         # Re-raise so Cloud Run knows startup failed (and logs show the root cause)
         raise
 
+    # Compile templates before the first request hits them
+    for name in ("index.html", "artifacts.html", "control_detail.html", "agent_report.html"):
+        templates.get_template(name)
+
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+
+# Templates only change on deploy: skip per-render mtime checks (set
+# TEMPLATES_AUTO_RELOAD=1 for local editing) and keep compiled bytecode
+# on disk so new workers don't re-parse them.
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "/tmp/jinja_cache")
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("templates"),
+        autoescape=True,
+        auto_reload=os.getenv("TEMPLATES_AUTO_RELOAD", "0") == "1",
+        bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+        cache_size=400,
+    )
+)
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def upload_bytes_to_gcs(filename: str, content: bytes) -> str:
+# Max ArtifactChunk rows per INSERT statement
+CHUNK_INSERT_BATCH = 1000
+
+# Bytes read from an upload per iteration when copying it to disk
+UPLOAD_READ_CHUNK = 1 << 20
+
+def upload_file_to_gcs(filename: str, path: str) -> str:
     bucket_name = os.getenv("GCS_BUCKET")
     if not bucket_name:
         raise RuntimeError("GCS_BUCKET env var is not set")
@@ -76,52 +229,103 @@ def upload_bytes_to_gcs(filename: str, content: bytes) -> str:
     client = storage.Client()
     bucket = client.bucket(bucket_name)
 
+    # upload_from_filename streams from disk (resumable for large files)
     blob = bucket.blob(filename)
-    blob.upload_from_string(content)
+    blob.upload_from_filename(path)
 
     # Return a stable URI you can store in DB
     return f"gs://{bucket_name}/{filename}"
 
+
+def index_artifact(artifact_id: int, path: str) -> None:
+    """
+    Chunks a saved upload into ArtifactChunk rows. Runs as a background
+    task after the upload response, so it uses its own session.
+    """
+    db = SessionLocal()
+    try:
+        # chunk_file decodes any upload as UTF-8 and mmaps large ones
+        chunks = enumerate(chunk_file(path))
+        embed = hybrid_enabled()
+
+        # Multi-row INSERTs, capped per statement for very large documents
+        while batch := list(islice(chunks, CHUNK_INSERT_BATCH)):
+            # Embed at ingest (hybrid deployments only) so retrieval never
+            # re-encodes stored chunks; otherwise they're backfilled on first use
+            embs = (embed and encode_chunk_texts([ch for _, ch in batch])) or [None] * len(batch)
+            db.bulk_insert_mappings(
+                ArtifactChunk,
+                [
+                    {"artifact_id": artifact_id, "chunk_index": i, "text": ch, "embedding": emb}
+                    for (i, ch), emb in zip(batch, embs)
+                ],
+            )
+
+        db.commit()
+    except Exception as e:
+        # The artifact keeps zero chunks; re-uploading the same file retries indexing
+        db.rollback()
+        logger.exception("Indexing failed for artifact %s: %s", artifact_id, str(e))
+    finally:
+        db.close()
+        # GCS holds the durable copy; local disk on Cloud Run is memory-backed
+        with suppress(OSError):
+            os.remove(path)
+
+
 # ----------------------------
 # Utility: Scoring
 # ----------------------------
-def compute_scores(linked_artifacts, checklist_count: int):
-    # Coverage
-    if checklist_count <= 0:
-        coverage_pct = 0.0
-    else:
-        coverage_pct = min(100.0, (len(linked_artifacts) / checklist_count) * 100.0)
-
-    # Freshness
-    freshness_score = 0.0
-    if linked_artifacts:
-        newest = max(
-            (a.collected_at for a in linked_artifacts if a.collected_at is not None),
-            default=None,
-        )
-        if newest is not None:
-            now = datetime.utcnow()
-            newest_naive = newest.replace(tzinfo=None) if newest.tzinfo is not None else newest
-            age_days = (now - newest_naive).days
-
-            if age_days <= 90:
-                freshness_score = 100.0
-            elif age_days <= 180:
-                freshness_score = 50.0
-            else:
-                freshness_score = 0.0
+def make_scorer(
+    cov_w: float = 0.5,
+    fresh_w: float = 0.3,
+    cred_w: float = 0.2,
+    fresh_edges=(90, 180),
+    fresh_vals=(100.0, 50.0, 0.0),
+):
+    """
+    Returns score(count, age_days, github_count, checklist_count) with the
+    weights and freshness ladder bound in. age_days is None when no linked
+    artifact has a collected_at. Ages are reduced to their freshness bucket,
+    so recomputes over unchanged evidence are served from an LRU cache.
+    """
+
+    @lru_cache(maxsize=4096)
+    def _score(count: int, fresh_bucket, github_count: int, checklist_count: int):
+        # Coverage
+        if checklist_count <= 0:
+            coverage_pct = 0.0
+        else:
+            coverage_pct = min(100.0, (count / checklist_count) * 100.0)
+
+        # Freshness
+        freshness_score = 0.0 if fresh_bucket is None else fresh_vals[fresh_bucket]
+
+        # Source credibility: mean weight with github = 1.0 and everything else 0.7,
+        # i.e. (0.7 + 0.3 * github share) * 100
+        source_credibility = (70.0 + 30.0 * github_count / count) if count > 0 else 0.0
+
+        readiness_score = cov_w * coverage_pct + fresh_w * freshness_score + cred_w * source_credibility
+        return coverage_pct, freshness_score, source_credibility, readiness_score
+
+    def score(count: int, age_days, github_count: int, checklist_count: int):
+        fresh_bucket = None if age_days is None else bisect_left(fresh_edges, age_days)
+        return _score(count, fresh_bucket, github_count, checklist_count)
+
+    return score
 
-    # Source credibility
-    if not linked_artifacts:
-        source_credibility = 0.0
-    else:
-        weights = []
-        for a in linked_artifacts:
-            weights.append(1.0 if a.source == "github" else 0.7)
-        source_credibility = (sum(weights) / len(weights)) * 100.0
 
-    readiness_score = 0.5 * coverage_pct + 0.3 * freshness_score + 0.2 * source_credibility
-    return coverage_pct, freshness_score, source_credibility, readiness_score
+_score_fn = make_scorer()
+
+
+def compute_scores_from_stats(count: int, newest_ts, github_count: int, checklist_count: int):
+    """
+    Scores from aggregate evidence stats: number of linked artifacts, newest
+    collected_at as UTC epoch seconds (or None) and how many of them come
+    from github.
+    """
+    age_days = None if newest_ts is None else (int(time.time()) - int(newest_ts)) // 86400
+    return _score_fn(count, age_days, github_count, checklist_count)
 
 
 # ----------------------------
@@ -132,17 +336,27 @@ def health():
     return {"status": "ok"}
 
 
+def _load_controls(db):
+    # Plain dicts, not ORM rows: the cached tuple outlives the session it was loaded in
+    return tuple(
+        {
+            "id": c.id,
+            "code": c.code,
+            "title": c.title,
+            "description": c.description,
+            "category": c.category,
+        }
+        for c in db.query(Control).order_by(Control.category, Control.code).all()
+    )
+
+
 @app.get("/", response_class=HTMLResponse)
-def home(request: Request):
-    db = SessionLocal()
-    try:
-        controls = db.query(Control).order_by(Control.category, Control.code).all()
-        return templates.TemplateResponse(
-            "index.html",
-            {"request": request, "controls": controls},
-        )
-    finally:
-        db.close()
+def home(request: Request, db: Session = Depends(get_db)):
+    controls = controls_cache.get(lambda: _load_controls(db))
+    return templates.TemplateResponse(
+        "index.html",
+        {"request": request, "controls": controls},
+    )
 
 @app.get("/debug/db")
 def debug_db():
@@ -158,21 +372,90 @@ def debug_db():
 # ----------------------------
 # Artifacts
 # ----------------------------
+async def _load_artifacts(db):
+    # Built while the AsyncSession is open; templates can't lazy-load attributes on async sessions
+    rows = (await db.scalars(select(Artifact).order_by(Artifact.collected_at.desc()))).all()
+    return tuple(
+        {
+            "id": a.id,
+            "source": a.source,
+            "name": a.name,
+            "uri": a.uri,
+            "collected_at": a.collected_at,
+        }
+        for a in rows
+    )
+
+
 @app.get("/artifacts", response_class=HTMLResponse)
-def artifacts_page(request: Request):
+async def artifacts_page(request: Request, db: AsyncSession = Depends(get_async_db)):
+    artifacts = await artifacts_cache.aget(lambda: _load_artifacts(db))
+    return templates.TemplateResponse(
+        "artifacts.html",
+        {"request": request, "artifacts": artifacts},
+    )
+
+
+def _copy_indexed_duplicate(content_sha: str, source: str, name: str) -> bool:
+    """
+    Same bytes seen before and already indexed: stores a new Artifact that
+    reuses the stored object and copies its chunks in SQL instead of
+    re-uploading and re-indexing. A match without chunks (indexing still
+    running, failed, or empty) returns False and is indexed again, so a
+    re-upload doubles as a retry.
+    """
     db = SessionLocal()
     try:
-        artifacts = db.query(Artifact).order_by(Artifact.collected_at.desc()).all()
-        return templates.TemplateResponse(
-            "artifacts.html",
-            {"request": request, "artifacts": artifacts},
+        has_chunks = select(ArtifactChunk.id).where(ArtifactChunk.artifact_id == Artifact.id).exists()
+        existing = (
+            db.query(Artifact)
+            .filter(Artifact.content_sha == content_sha, has_chunks)
+            .first()
+        )
+        if not existing:
+            return False
+
+        artifact = Artifact(source=source, name=name, uri=existing.uri, content_sha=content_sha)
+        db.add(artifact)
+        db.flush()
+
+        db.execute(
+            insert(ArtifactChunk).from_select(
+                ["artifact_id", "chunk_index", "text", "embedding"],
+                select(
+                    literal(artifact.id),
+                    ArtifactChunk.chunk_index,
+                    ArtifactChunk.text,
+                    ArtifactChunk.embedding,
+                )
+                .where(ArtifactChunk.artifact_id == existing.id),
+            )
         )
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def _store_artifact(source: str, name: str, uri: str, content_sha: str) -> int:
+    db = SessionLocal()
+    try:
+        artifact = Artifact(
+            source=source,
+            name=name,
+            uri=uri,   # store GCS URI instead of local path
+            content_sha=content_sha,
+        )
+        db.add(artifact)
+        db.commit()
+        return artifact.id
     finally:
         db.close()
 
 
 @app.post("/artifacts/upload")
 async def upload_artifact(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     source: str = Form("upload"),
 ):
@@ -180,40 +463,36 @@ async def upload_artifact(
     safe_name = (file.filename or "upload").replace("/", "_").replace("\\", "_")
     saved_name = f"{ts}_{safe_name}"
 
-    contents = await file.read()
+    save_path = os.path.join(UPLOAD_DIR, saved_name)
 
-    # Upload to GCS (persistent)
-    gcs_uri = upload_bytes_to_gcs(saved_name, contents)
-
-    # Store metadata in DB + index chunks
-    db = SessionLocal()
-    try:
-        artifact = Artifact(
-            source=source,
-            name=file.filename,
-            uri=gcs_uri,   # store GCS URI instead of local path
-        )
-        db.add(artifact)
-        db.commit()
-        db.refresh(artifact)
+    # Copy the upload to disk in fixed-size chunks so memory stays flat,
+    # hashing as we go to spot re-uploads of the same file. aiofiles runs
+    # the writes on a thread so the event loop keeps serving other requests.
+    sha = hashlib.sha256()
+    async with aiofiles.open(save_path, "wb") as f:
+        while chunk := await file.read(UPLOAD_READ_CHUNK):
+            sha.update(chunk)
+            await f.write(chunk)
+    content_sha = sha.hexdigest()
 
-        # Index chunks: for now, index text from uploaded bytes
-        # If it's binary (PDF), your read_text_from_file won't work on bytes,
-        # so for now restrict to text uploads for indexing.
-        # We'll handle PDFs later if you want.
-        try:
-            text = contents.decode("utf-8", errors="ignore")
-        except Exception:
-            text = ""
+    # Blocking DB / GCS / filesystem calls run in worker threads, off the event loop
+    if await asyncio.to_thread(_copy_indexed_duplicate, content_sha, source, file.filename):
+        await asyncio.to_thread(os.remove, save_path)
+        artifacts_cache.invalidate()
+        return RedirectResponse(url="/artifacts", status_code=303)
 
-        chunks = chunk_text(text)
+    try:
+        # Upload to GCS (persistent)
+        gcs_uri = await asyncio.to_thread(upload_file_to_gcs, saved_name, save_path)
+    except Exception:
+        await asyncio.to_thread(os.remove, save_path)
+        raise
 
-        for i, ch in enumerate(chunks):
-            db.add(ArtifactChunk(artifact_id=artifact.id, chunk_index=i, text=ch))
+    # Store metadata in DB; chunks are indexed after the response is sent
+    artifact_id = await asyncio.to_thread(_store_artifact, source, file.filename, gcs_uri, content_sha)
+    artifacts_cache.invalidate()
 
-        db.commit()
-    finally:
-        db.close()
+    background_tasks.add_task(index_artifact, artifact_id, save_path)
 
     return RedirectResponse(url="/artifacts", status_code=303)
 
@@ -223,141 +502,169 @@ async def upload_artifact(
 # Controls
 # ----------------------------
 @app.get("/controls/{control_id}", response_class=HTMLResponse)
-def control_detail(request: Request, control_id: int):
-    db = SessionLocal()
-    try:
-        control = db.query(Control).filter(Control.id == control_id).first()
-        if not control:
-            return HTMLResponse("Control not found", status_code=404)
-
-        checklist = (
-            db.query(ChecklistItem)
-            .filter(ChecklistItem.control_id == control_id)
-            .order_by(ChecklistItem.id.asc())
-            .all()
-        )
-
-        links = db.query(ControlArtifactLink).filter(ControlArtifactLink.control_id == control_id).all()
-        linked_artifacts = [
-            db.query(Artifact).filter(Artifact.id == l.artifact_id).first()
-            for l in links
-        ]
-        linked_artifacts = [a for a in linked_artifacts if a is not None]
-
-        all_artifacts = db.query(Artifact).order_by(Artifact.collected_at.desc()).all()
-
-        latest_score = (
-            db.query(ControlScore)
-            .filter(ControlScore.control_id == control_id)
-            .order_by(ControlScore.computed_at.desc())
-            .first()
+async def control_detail(request: Request, control_id: int, db: AsyncSession = Depends(get_async_db)):
+    # Control + checklist + open gaps: one SELECT for the control, then one
+    # IN-batched SELECT per collection (instead of three separate lookups)
+    control = await db.get(
+        Control,
+        control_id,
+        options=[
+            selectinload(Control.checklist_items),
+            selectinload(Control.gaps.and_(Gap.resolved_at.is_(None))),
+        ],
+    )
+    if not control:
+        return HTMLResponse("Control not found", status_code=404)
+
+    # The page lists every artifact anyway, so load them once and pick the
+    # linked ones (in link order) from that list
+    link_ids = (
+        await db.scalars(
+            select(ControlArtifactLink.artifact_id)
+            .where(ControlArtifactLink.control_id == control_id)
+            .order_by(ControlArtifactLink.id.asc())
         )
-
-        gaps = (
-            db.query(Gap)
-            .filter(Gap.control_id == control_id, Gap.resolved_at.is_(None))
-            .order_by(Gap.created_at.desc())
-            .all()
-        )
-
-        return templates.TemplateResponse(
-            "control_detail.html",
-            {
-                "request": request,
-                "control": control,
-                "checklist": checklist,
-                "linked": linked_artifacts,
-                "all_artifacts": all_artifacts,
-                "latest_score": latest_score,
-                "gaps": gaps,
-            },
-        )
-    finally:
-        db.close()
+    ).all()
+
+    all_artifacts = (await db.scalars(select(Artifact).order_by(Artifact.collected_at.desc()))).all()
+    by_id = {a.id: a for a in all_artifacts}
+    linked_artifacts = [by_id[aid] for aid in link_ids if aid in by_id]
+
+    latest_score = await db.scalar(
+        select(ControlScore)
+        .where(ControlScore.control_id == control_id)
+        .order_by(ControlScore.computed_at.desc())
+        .limit(1)
+    )
+
+    return templates.TemplateResponse(
+        "control_detail.html",
+        {
+            "request": request,
+            "control": control,
+            "checklist": control.checklist_items,
+            "linked": linked_artifacts,
+            "all_artifacts": all_artifacts,
+            "latest_score": latest_score,
+            "gaps": control.gaps,
+        },
+    )
 
 
 @app.post("/controls/{control_id}/link-artifact")
-def link_artifact(control_id: int, artifact_id: int = Form(...)):
-    db = SessionLocal()
-    try:
-        exists = (
-            db.query(ControlArtifactLink)
-            .filter(
-                ControlArtifactLink.control_id == control_id,
-                ControlArtifactLink.artifact_id == artifact_id,
-            )
-            .first()
+def link_artifact(control_id: int, artifact_id: int = Form(...), db: Session = Depends(get_db)):
+    # One statement: NOT EXISTS skips re-links even if the unique index is
+    # missing, and the (control_id, artifact_id) index covers concurrent ones
+    already_linked = (
+        select(ControlArtifactLink.id)
+        .where(
+            ControlArtifactLink.control_id == control_id,
+            ControlArtifactLink.artifact_id == artifact_id,
         )
-        if not exists:
-            db.add(ControlArtifactLink(control_id=control_id, artifact_id=artifact_id))
-            db.commit()
+        .exists()
+    )
+    db.execute(
+        insert_ignore(ControlArtifactLink).from_select(
+            ["control_id", "artifact_id"],
+            select(literal(control_id), literal(artifact_id)).where(~already_linked),
+        )
+    )
+    db.commit()
 
-        return RedirectResponse(url=f"/controls/{control_id}", status_code=303)
-    finally:
-        db.close()
+    return RedirectResponse(url=f"/controls/{control_id}", status_code=303)
 
 
 @app.post("/controls/{control_id}/compute-score")
-def compute_score(control_id: int):
-    db = SessionLocal()
-    try:
-        checklist_count = db.query(ChecklistItem).filter(ChecklistItem.control_id == control_id).count()
-
-        links = db.query(ControlArtifactLink).filter(ControlArtifactLink.control_id == control_id).all()
-        linked_artifacts = [
-            db.query(Artifact).filter(Artifact.id == l.artifact_id).first()
-            for l in links
-        ]
-        linked_artifacts = [a for a in linked_artifacts if a is not None]
-
-        coverage_pct, freshness_score, source_credibility, readiness_score = compute_scores(
-            linked_artifacts, checklist_count
+def compute_score(control_id: int, db: Session = Depends(get_db)):
+    checklist_count = (
+        select(func.count(ChecklistItem.id))
+        .where(ChecklistItem.control_id == control_id)
+        .scalar_subquery()
+    )
+
+    # Only counts/newest/github share are needed, so aggregate in SQL instead of
+    # loading artifacts; the checklist count rides along as a scalar subquery
+    linked_count, newest_ts, github_count, checklist_count = (
+        db.query(
+            func.count(Artifact.id),
+            func.max(Artifact.collected_at_ts),
+            func.sum(case((Artifact.source == "github", 1), else_=0)),
+            checklist_count,
         )
-
-        db.add(
-            ControlScore(
-                control_id=control_id,
-                coverage_pct=coverage_pct,
-                freshness_score=freshness_score,
-                source_credibility=source_credibility,
-                readiness_score=readiness_score,
-            )
+        .select_from(Artifact)
+        .join(ControlArtifactLink, ControlArtifactLink.artifact_id == Artifact.id)
+        .filter(ControlArtifactLink.control_id == control_id)
+        .one()
+    )
+
+    coverage_pct, freshness_score, source_credibility, readiness_score = compute_scores_from_stats(
+        linked_count, newest_ts, github_count or 0, checklist_count or 0
+    )
+
+    new_gaps = []
+    if coverage_pct < 100.0:
+        new_gaps.append({"severity": "High", "reason": "Missing evidence: coverage below 100%"})
+    if freshness_score < 100.0:
+        new_gaps.append({"severity": "Medium", "reason": "Evidence may be stale (older than 90 days)"})
+    if source_credibility < 80.0 and linked_count:
+        new_gaps.append({"severity": "Low", "reason": "Evidence relies heavily on manual uploads vs system sources"})
+
+    # Score + gap refresh as explicit statements in one transaction:
+    # one INSERT for the score, one UPDATE, one multi-row INSERT for the gaps
+    db.execute(
+        insert(ControlScore).values(
+            control_id=control_id,
+            coverage_pct=coverage_pct,
+            freshness_score=freshness_score,
+            source_credibility=source_credibility,
+            readiness_score=readiness_score,
         )
+    )
 
-        db.query(Gap).filter(
-            Gap.control_id == control_id,
-            Gap.resolved_at.is_(None),
-        ).update({Gap.resolved_at: datetime.now(timezone.utc).replace(tzinfo=None)})
+    db.execute(
+        update(Gap)
+        .where(Gap.control_id == control_id, Gap.resolved_at.is_(None))
+        .values(resolved_at=datetime.now(timezone.utc).replace(tzinfo=None))
+    )
 
-        if coverage_pct < 100.0:
-            db.add(Gap(control_id=control_id, severity="High", reason="Missing evidence: coverage below 100%"))
-        if freshness_score < 100.0:
-            db.add(Gap(control_id=control_id, severity="Medium", reason="Evidence may be stale (older than 90 days)"))
-        if source_credibility < 80.0 and linked_artifacts:
-            db.add(Gap(control_id=control_id, severity="Low", reason="Evidence relies heavily on manual uploads vs system sources"))
+    if new_gaps:
+        db.execute(insert(Gap).values([{"control_id": control_id, **gap} for gap in new_gaps]))
 
-        db.commit()
-        return RedirectResponse(url=f"/controls/{control_id}", status_code=303)
-    finally:
-        db.close()
+    db.commit()
+    return RedirectResponse(url=f"/controls/{control_id}", status_code=303)
 
 
 # ----------------------------
 # Agent Report (OpenAI)
 # ----------------------------
 @app.post("/controls/{control_id}/agent-report", response_class=HTMLResponse)
-def agent_report(control_id: int, request: Request):
-    db = SessionLocal()
-    try:
-        control = db.query(Control).filter(Control.id == control_id).first()
-        if not control:
-            return HTMLResponse("Control not found", status_code=404)
+async def agent_report(control_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    control = await db.get(Control, control_id)
+    # End the read transaction so the pooled connection isn't held while waiting on the LLM.
+    await db.commit()
 
-        report, mode = generate_control_report(control_id)
+    if not control:
+        return HTMLResponse("Control not found", status_code=404)
 
-        return templates.TemplateResponse(
-            "agent_report.html",
-            {"request": request, "control": control, "report": report, "mode": mode},
-        )
-    finally:
-        db.close()
+    report, mode = await agenerate_control_report(control_id)
+
+    return templates.TemplateResponse(
+        "agent_report.html",
+        {"request": request, "control": control, "report": report, "mode": mode},
+    )
+
+
+def _sse_events(chunks):
+    # Server-Sent Events framing: multi-line text becomes several data: lines
+    for chunk in chunks:
+        yield "".join(f"data: {line}\n" for line in chunk.split("\n")) + "\n"
+    yield "event: done\ndata: \n\n"
+
+
+@app.get("/controls/{control_id}/agent-report/stream")
+def agent_report_stream(control_id: int):
+    return StreamingResponse(
+        _sse_events(stream_control_report(control_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
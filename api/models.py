@@ -1,8 +1,12 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text
+import calendar
+
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from .db import Base
-from sqlalchemy import Boolean, Float
 
 class Control(Base):
     __tablename__ = "controls"
@@ -15,6 +19,27 @@ class Control(Base):
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    checklist_items = relationship(
+        "ChecklistItem", back_populates="control", order_by="ChecklistItem.id"
+    )
+    gaps = relationship("Gap", back_populates="control", order_by="Gap.created_at.desc()")
+
+
+class epoch_seconds(FunctionElement):
+    """UTC timestamp column -> integer seconds since the epoch, per dialect."""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(epoch_seconds)
+def _epoch_seconds_default(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM " + compiler.process(element.clauses, **kw) + ") AS BIGINT)"
+
+
+@compiles(epoch_seconds, "sqlite")
+def _epoch_seconds_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%s', " + compiler.process(element.clauses, **kw) + ") AS INTEGER)"
+
 
 class Artifact(Base):
     __tablename__ = "artifacts"
@@ -24,13 +49,25 @@ class Artifact(Base):
     name = Column(String(255), nullable=False)
     uri = Column(Text, nullable=True)  # later: Cloud Storage path / GitHub URL
     collected_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    content_sha = Column(String(64), nullable=True, index=True)  # sha256 of the uploaded bytes
+
+    @hybrid_property
+    def collected_at_ts(self):
+        # Naive values are UTC (SQLite); timegm treats them that way
+        if self.collected_at is None:
+            return None
+        return calendar.timegm(self.collected_at.utctimetuple())
+
+    @collected_at_ts.expression
+    def collected_at_ts(cls):
+        return epoch_seconds(cls.collected_at)
 
 
 class AgentRun(Base):
     __tablename__ = "agent_runs"
 
     id = Column(Integer, primary_key=True, index=True)
-    control_id = Column(Integer, ForeignKey("controls.id"), nullable=False)
+    control_id = Column(Integer, ForeignKey("controls.id"), nullable=False, index=True)
     status = Column(String(30), nullable=False, default="created")  # created/running/done/failed
     notes = Column(Text, nullable=True)
 
@@ -39,27 +76,30 @@ class AgentRun(Base):
 
     control = relationship("Control")
 
-from sqlalchemy import Boolean, Float
 
 class ChecklistItem(Base):
     __tablename__ = "checklist_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    control_id = Column(Integer, ForeignKey("controls.id"), nullable=False)
+    control_id = Column(Integer, ForeignKey("controls.id"), nullable=False, index=True)
     text = Column(String(300), nullable=False)
     required = Column(Boolean, default=True, nullable=False)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
-    control = relationship("Control")
+    control = relationship("Control", back_populates="checklist_items")
 
 
 class ControlArtifactLink(Base):
     __tablename__ = "control_artifact_links"
+    __table_args__ = (
+        Index("ix_link_control_artifact", "control_id", "artifact_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     control_id = Column(Integer, ForeignKey("controls.id"), nullable=False)
-    artifact_id = Column(Integer, ForeignKey("artifacts.id"), nullable=False)
+    # control_id lookups use the leading column of ix_link_control_artifact
+    artifact_id = Column(Integer, ForeignKey("artifacts.id"), nullable=False, index=True)
 
     linked_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
@@ -69,6 +109,9 @@ class ControlArtifactLink(Base):
 
 class ControlScore(Base):
     __tablename__ = "control_scores"
+    __table_args__ = (
+        Index("ix_controlscore_control_computed", "control_id", "computed_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     control_id = Column(Integer, ForeignKey("controls.id"), nullable=False)
@@ -85,6 +128,9 @@ class ControlScore(Base):
 
 class Gap(Base):
     __tablename__ = "gaps"
+    __table_args__ = (
+        Index("ix_gap_control_unresolved", "control_id", "resolved_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     control_id = Column(Integer, ForeignKey("controls.id"), nullable=False)
@@ -95,16 +141,66 @@ class Gap(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     resolved_at = Column(DateTime(timezone=True), nullable=True)
 
-    control = relationship("Control")
+    control = relationship("Control", back_populates="gaps")
 
 class ArtifactChunk(Base):
     __tablename__ = "artifact_chunks"
+    __table_args__ = (
+        # Per-artifact snippet / copy queries read chunks in chunk_index order
+        Index("ix_chunk_artifact_index", "artifact_id", "chunk_index"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     artifact_id = Column(Integer, ForeignKey("artifacts.id"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
     text = Column(Text, nullable=False)
+    embedding = Column(LargeBinary, nullable=True)  # normalized float32 MiniLM vector
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     artifact = relationship("Artifact")
+
+
+class ReportBatch(Base):
+    __tablename__ = "report_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    openai_batch_id = Column(String(100), unique=True, index=True, nullable=False)
+    status = Column(String(30), nullable=False, default="submitted")  # OpenAI batch status, or "collected"
+    control_ids = Column(Text, nullable=False)  # comma-separated control ids in the batch
+    input_file_id = Column(String(100), nullable=True)
+    output_file_id = Column(String(100), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    collected_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class PromptCache(Base):
+    __tablename__ = "prompt_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 of model + final prompt
+    control_id = Column(Integer, nullable=True, index=True)  # semantic matches stay within a control
+    model = Column(String(100), nullable=True)  # OPENAI_MODEL that produced the response
+    embedding = Column(LargeBinary, nullable=True)  # float32 embedding of the per-control block (semantic tier)
+    response = Column(Text, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    last_used_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class ExportWatermark(Base):
+    __tablename__ = "export_watermarks"
+
+    table_name = Column(String(200), primary_key=True)  # BigQuery table id
+    last_id = Column(Integer, nullable=False, default=0)  # highest source row id exported
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class SchemaMeta(Base):
+    __tablename__ = "schema_meta"
+
+    id = Column(Integer, primary_key=True)  # single row, id = 1
+    version = Column(Integer, nullable=False)  # SCHEMA_VERSION in main.py last applied
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
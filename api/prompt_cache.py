@@ -0,0 +1,170 @@
+# api/prompt_cache.py
+#
+# Two-tier cache in front of the LLM call:
+#   1) exact match on sha256(model + prompt)
+#   2) optional semantic match (ENABLE_SEMANTIC_PROMPT_CACHE=1): cosine
+#      similarity of the per-control part of the prompt (everything after
+#      PROMPT_SEPARATOR) against cached prompts for the same control and model
+#
+# Only the dynamic block is embedded: every prompt starts with the same
+# static preamble, and MiniLM truncates long inputs, so whole-prompt
+# embeddings of different controls look near-identical.
+
+import os
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func
+
+from .db import SessionLocal
+from .models import PromptCache
+from .retrieval import _get_model
+
+logger = logging.getLogger(__name__)
+
+MAX_ROWS = int(os.getenv("PROMPT_CACHE_MAX_ROWS", "10000"))
+TTL_DAYS = int(os.getenv("PROMPT_CACHE_TTL_DAYS", "7"))
+SIM_THRESHOLD = float(os.getenv("PROMPT_CACHE_SIM_THRESHOLD", "0.92"))
+
+# Separates the static preamble from the per-control block in report prompts
+PROMPT_SEPARATOR = "\n\n---\n"
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _naive_utc(dt: datetime) -> datetime:
+    # Postgres returns tz-aware timestamps, SQLite naive ones.
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo is not None else dt
+
+
+def _enabled() -> bool:
+    return os.getenv("ENABLE_PROMPT_CACHE", "1") == "1"
+
+
+def _semantic_enabled() -> bool:
+    return os.getenv("ENABLE_SEMANTIC_PROMPT_CACHE", "0") == "1"
+
+
+def prompt_key(prompt: str, model: str) -> str:
+    # Model in the key: switching OPENAI_MODEL must not serve old responses
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def _embed(prompt: str) -> Optional[np.ndarray]:
+    model = _get_model()
+    if model is None:
+        return None
+    dynamic_block = prompt.split(PROMPT_SEPARATOR, 1)[-1]
+    return np.asarray(model.encode([dynamic_block], normalize_embeddings=True)[0], dtype=np.float32)
+
+
+def _semantic_match(db, prompt: str, model: str, control_id: int) -> Optional[PromptCache]:
+    # Candidates are limited to the same control and model, so a near-miss
+    # can never return another control's report
+    rows = (
+        db.query(PromptCache)
+        .filter(
+            PromptCache.control_id == control_id,
+            PromptCache.model == model,
+            PromptCache.embedding.isnot(None),
+        )
+        .all()
+    )
+    if not rows:
+        return None
+
+    q = _embed(prompt)
+    if q is None:
+        return None
+
+    matrix = np.vstack([np.frombuffer(r.embedding, dtype=np.float32) for r in rows])
+    sims = matrix @ q
+    best = int(np.argmax(sims))
+    return rows[best] if sims[best] >= SIM_THRESHOLD else None
+
+
+def lookup(prompt: str, model: str, control_id: int) -> Optional[str]:
+    """
+    Returns a cached response for this prompt and model, or None on miss.
+    Never raises; cache errors are treated as misses.
+    """
+    if not _enabled():
+        return None
+
+    db = SessionLocal()
+    try:
+        row = db.get(PromptCache, prompt_key(prompt, model))
+
+        if row is None and _semantic_enabled():
+            row = _semantic_match(db, prompt, model, control_id)
+
+        # Empty responses were never valid answers; don't serve ones stored earlier
+        if row is None or not row.response.strip():
+            return None
+
+        if _naive_utc(row.created_at) < _utcnow() - timedelta(days=TTL_DAYS):
+            return None
+
+        row.last_used_at = _utcnow()
+        db.commit()
+        return row.response
+    except Exception as e:
+        logger.exception("Prompt cache lookup failed: %s", str(e))
+        return None
+    finally:
+        db.close()
+
+
+def store(prompt: str, response: str, model: str, control_id: int) -> None:
+    """
+    Caches an LLM response and evicts expired / least recently used rows
+    beyond MAX_ROWS. Never raises.
+    """
+    if not _enabled():
+        return
+
+    db = SessionLocal()
+    try:
+        emb = _embed(prompt) if _semantic_enabled() else None
+        now = _utcnow()
+
+        db.merge(
+            PromptCache(
+                key=prompt_key(prompt, model),
+                control_id=control_id,
+                model=model,
+                embedding=emb.tobytes() if emb is not None else None,
+                response=response,
+                created_at=now,
+                last_used_at=now,
+            )
+        )
+        db.flush()
+
+        db.query(PromptCache).filter(
+            PromptCache.created_at < now - timedelta(days=TTL_DAYS)
+        ).delete(synchronize_session=False)
+
+        overflow = db.query(func.count(PromptCache.key)).scalar() - MAX_ROWS
+        if overflow > 0:
+            lru_keys = (
+                db.query(PromptCache.key)
+                .order_by(PromptCache.last_used_at.asc())
+                .limit(overflow)
+                .subquery()
+            )
+            db.query(PromptCache).filter(PromptCache.key.in_(lru_keys.select())).delete(
+                synchronize_session=False
+            )
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.exception("Prompt cache store failed: %s", str(e))
+    finally:
+        db.close()
@@ -2,14 +2,25 @@
 
 import os
 import logging
-from typing import Optional, List, Tuple, Dict
+import threading
+from typing import Dict, Optional, List, Tuple
 
+import joblib
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import make_pipeline
+from sqlalchemy import func
 
 from .db import SessionLocal
 from .models import Control, ChecklistItem, ArtifactChunk
+from .vector_operations import (
+    add_to_ann_index,
+    ann_query,
+    build_ann_index,
+    cosine_sim_matvec,
+    int8_sim_matvec,
+    quantize_rows,
+)
 
 # -----------------------------------------------------------------------------
 # Logging
@@ -20,12 +31,19 @@ logger = logging.getLogger(__name__)
 # Query construction
 # -----------------------------------------------------------------------------
 def control_query_text(db, control_id: int) -> str:
-    c = db.query(Control).filter(Control.id == control_id).first()
-    if not c:
+    # Control + checklist in one round trip (LEFT JOIN keeps controls without items)
+    rows = (
+        db.query(Control.code, Control.title, Control.description, ChecklistItem.text)
+        .outerjoin(ChecklistItem, ChecklistItem.control_id == Control.id)
+        .filter(Control.id == control_id)
+        .order_by(ChecklistItem.id)
+        .all()
+    )
+    if not rows:
         return ""
 
-    items = db.query(ChecklistItem).filter(ChecklistItem.control_id == control_id).all()
-    parts = [c.code, c.title, c.description] + [it.text for it in items]
+    code, title, description, _ = rows[0]
+    parts = [code, title, description] + [text for *_, text in rows]
     return " ".join([p for p in parts if p])
 
 
@@ -40,9 +58,118 @@ def load_chunks(db) -> List[Tuple[int, int, str]]:
     return [(r.id, r.artifact_id, r.text or "") for r in rows]
 
 
+def chunks_version(db) -> Tuple[Optional[int], int]:
+    """
+    Cheap change marker for artifact_chunks: (max id, row count).
+    Chunks are only ever appended, so this moves whenever the table does.
+    """
+    max_id, count = db.query(func.max(ArtifactChunk.id), func.count(ArtifactChunk.id)).one()
+    return max_id, count
+
+
+# -----------------------------------------------------------------------------
+# Chunk -> artifact ranking
+# -----------------------------------------------------------------------------
+TOP_CHUNKS = 200
+
+
+def top_artifacts(sims: np.ndarray, artifact_ids: np.ndarray, k: int) -> List[int]:
+    """
+    Scores each artifact by its best chunk among the TOP_CHUNKS most similar
+    chunks and returns the k best artifact_ids, highest first.
+    """
+    # O(n) partial selection of the best chunks; only those few get sorted
+    top_n = min(len(sims), TOP_CHUNKS)
+    top = np.argpartition(-sims, top_n - 1)[:top_n]
+    top = top[np.argsort(-sims[top], kind="stable")]
+    ids = artifact_ids[top]
+    scores = sims[top]
+
+    # Group by artifact: sort by id, then max over each run of equal ids
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    max_per = np.maximum.reduceat(scores[order], starts)
+    uniq = sorted_ids[starts]
+
+    if k < len(uniq):
+        best = np.argpartition(-max_per, k - 1)[:k]
+    else:
+        best = np.arange(len(uniq))
+    best = best[np.argsort(-max_per[best], kind="stable")]
+    return uniq[best].tolist()
+
+
 # -----------------------------------------------------------------------------
 # Keyword retrieval (TF-IDF)
 # -----------------------------------------------------------------------------
+# Stateless hashing tokenizer: no vocabulary dict to build on every fit.
+# Raw counts (norm=None) so TfidfTransformer applies idf before normalizing.
+_HASHER = HashingVectorizer(
+    n_features=2**18, alternate_sign=False, norm=None, stop_words="english"
+)
+
+# Fitted vectorizer + chunk matrix, rebuilt only when artifact_chunks changes.
+# Replaced as a whole so concurrent readers never see a half-updated entry.
+_TFIDF_CACHE = {"key": None, "vectorizer": None, "X": None, "artifact_ids": None}
+
+# One refit at a time: concurrent callers on a stale key wait for it instead
+# of each fitting the whole corpus
+_TFIDF_LOCK = threading.Lock()
+
+# Optional snapshot written by `python -m api.build_tfidf`, loaded at import so
+# a cold container doesn't refit before its first keyword query
+TFIDF_SNAPSHOT_PATH = os.getenv("TFIDF_SNAPSHOT_PATH", "models/tfidf.joblib")
+
+
+def build_tfidf_index(db) -> dict:
+    key = chunks_version(db)
+    chunks = load_chunks(db)
+    vectorizer, X = None, None
+    if chunks:
+        vectorizer = make_pipeline(_HASHER, TfidfTransformer(sublinear_tf=True))
+        X = vectorizer.fit_transform([t for _, _, t in chunks])
+
+    artifact_ids = np.array([aid for _, aid, _ in chunks], dtype=np.int64)
+    return {"key": key, "vectorizer": vectorizer, "X": X, "artifact_ids": artifact_ids}
+
+
+def _load_tfidf_snapshot() -> None:
+    global _TFIDF_CACHE
+
+    if not os.path.exists(TFIDF_SNAPSHOT_PATH):
+        return
+    try:
+        _TFIDF_CACHE = joblib.load(TFIDF_SNAPSHOT_PATH)
+        logger.info("Loaded TF-IDF snapshot from %s", TFIDF_SNAPSHOT_PATH)
+    except Exception as e:
+        # Stale/corrupt snapshot: fall back to fitting on demand
+        logger.exception("TF-IDF snapshot load failed: %s", str(e))
+
+
+_load_tfidf_snapshot()
+
+
+def _get_tfidf_index(db) -> dict:
+    global _TFIDF_CACHE
+
+    # A snapshot (or earlier fit) is reused only while the chunk table is unchanged
+    key = chunks_version(db)
+    cache = _TFIDF_CACHE
+    if cache["key"] == key:
+        return cache
+
+    with _TFIDF_LOCK:
+        # Another caller may have refit while we waited
+        cache = _TFIDF_CACHE
+        if cache["key"] == key:
+            return cache
+
+        cache = build_tfidf_index(db)
+        _TFIDF_CACHE = cache
+        return cache
+
+
 def keyword_retrieve(control_id: int, k: int = 10) -> List[int]:
     db = SessionLocal()
     try:
@@ -50,29 +177,15 @@ def keyword_retrieve(control_id: int, k: int = 10) -> List[int]:
         if not query:
             return []
 
-        chunks = load_chunks(db)
-        if not chunks:
+        index = _get_tfidf_index(db)
+        if index["X"] is None:
             return []
 
-        chunk_texts = [t for _, _, t in chunks]
-
-        vectorizer = TfidfVectorizer(stop_words="english")
-        X = vectorizer.fit_transform(chunk_texts)
-        q = vectorizer.transform([query])
-
-        sims = cosine_similarity(q, X).flatten()
-        ranked = np.argsort(-sims)
+        q = index["vectorizer"].transform([query])
 
-        # Aggregate chunk scores to artifact scores (max over chunks)
-        artifact_scores: Dict[int, float] = {}
-        top_n = min(len(ranked), 200)
-        for idx in ranked[:top_n]:
-            _, artifact_id, _ = chunks[idx]
-            score = float(sims[idx])
-            artifact_scores[artifact_id] = max(artifact_scores.get(artifact_id, 0.0), score)
-
-        top = sorted(artifact_scores.items(), key=lambda x: x[1], reverse=True)[:k]
-        return [aid for aid, _ in top]
+        # TfidfTransformer rows are already L2-normalized: cosine == dot product
+        sims = (index["X"] @ q.T).toarray().ravel()
+        return top_artifacts(sims, index["artifact_ids"], k)
     finally:
         db.close()
 
@@ -115,10 +228,199 @@ def _get_model() -> Optional["SentenceTransformer"]:
         return None
 
 
+def hybrid_enabled() -> bool:
+    # Embeddings are opt-in; without the flag no container loads MiniLM/torch
+    return os.getenv("ENABLE_HYBRID_RETRIEVAL", "0") == "1"
+
+
+def encode_chunk_texts(texts: List[str]) -> Optional[List[bytes]]:
+    """
+    Normalized float32 embeddings as bytes for ArtifactChunk.embedding,
+    or None if the model isn't available (chunks get backfilled later).
+    """
+    model = _get_model()
+    if model is None or not texts:
+        return None
+    try:
+        emb = np.asarray(model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+    except Exception as e:
+        # Chunks are still stored (keyword search works); embeddings get backfilled
+        logger.exception("Chunk embedding failed: %s", str(e))
+        return None
+    return [row.tobytes() for row in emb]
+
+
+# Chunk embedding matrix + owning artifact ids, rebuilt when artifact_chunks changes.
+# With ENABLE_INT8_EMBEDDINGS=1 the matrix is held as int8 rows + per-row scales
+# (4x less memory to keep resident and stream per query; DB keeps float32).
+_EMBEDDING_CACHE = {
+    "key": None,
+    "matrix": None,
+    "scales": None,
+    "ann": None,
+    "artifact_ids": None,
+    "last_id": None,  # highest ArtifactChunk.id included
+}
+
+# Above this many chunks (and with hnswlib installed) queries go through an
+# HNSW index instead of scoring every chunk
+ANN_MIN_CHUNKS = int(os.getenv("ANN_MIN_CHUNKS", "10000"))
+
+
+# One rebuild (and backfill) at a time, same as the TF-IDF index
+_EMBEDDING_LOCK = threading.Lock()
+
+
+def _int8_enabled() -> bool:
+    return os.getenv("ENABLE_INT8_EMBEDDINGS", "0") == "1"
+
+BACKFILL_BATCH = 256
+
+
+def _backfill_embeddings(db) -> None:
+    # Chunks written before embeddings existed, or while the model was unavailable
+    while True:
+        rows = (
+            db.query(ArtifactChunk.id, ArtifactChunk.text)
+            .filter(ArtifactChunk.embedding.is_(None))
+            .limit(BACKFILL_BATCH)
+            .all()
+        )
+        if not rows:
+            return
+
+        embs = encode_chunk_texts([t or "" for _, t in rows])
+        if embs is None:
+            return
+        db.bulk_update_mappings(
+            ArtifactChunk, [{"id": cid, "embedding": emb} for (cid, _), emb in zip(rows, embs)]
+        )
+        db.commit()
+
+
+def _load_embedding_rows(db, after_id: int = 0):
+    """(float32 matrix or None, artifact ids, last chunk id) for embedded chunks after after_id."""
+    rows = (
+        db.query(ArtifactChunk.id, ArtifactChunk.artifact_id, ArtifactChunk.embedding)
+        .filter(ArtifactChunk.embedding.isnot(None), ArtifactChunk.id > after_id)
+        .order_by(ArtifactChunk.id)
+        .all()
+    )
+    if not rows:
+        return None, np.empty(0, dtype=np.int64), after_id
+
+    matrix = np.frombuffer(b"".join(emb for _, _, emb in rows), dtype=np.float32).reshape(len(rows), -1)
+    artifact_ids = np.array([aid for _, aid, _ in rows], dtype=np.int64)
+    return matrix, artifact_ids, rows[-1][0]
+
+
+def _build_embedding_index(db, key) -> dict:
+    matrix, artifact_ids, last_id = _load_embedding_rows(db)
+    scales, ann = None, None
+    if matrix is not None:
+        if len(artifact_ids) >= ANN_MIN_CHUNKS:
+            ann = build_ann_index(matrix)
+        if _int8_enabled():
+            matrix, scales = quantize_rows(matrix)
+
+    return {
+        "key": key,
+        "matrix": matrix,
+        "scales": scales,
+        "ann": ann,
+        "artifact_ids": artifact_ids,
+        "last_id": last_id,
+    }
+
+
+def _extend_embedding_index(db, key, prev: dict) -> Optional[dict]:
+    """
+    Chunks are only ever appended, so usually the new index is the previous
+    one plus the rows after prev["last_id"]. Returns None when that doesn't
+    hold (older rows were backfilled/removed, or the ANN index is full or
+    newly needed) and the caller rebuilds from scratch.
+    """
+    if prev["matrix"] is None or (prev["scales"] is not None) != _int8_enabled():
+        return None
+
+    n = len(prev["artifact_ids"])
+    unchanged = (
+        db.query(func.count(ArtifactChunk.id))
+        .filter(ArtifactChunk.embedding.isnot(None), ArtifactChunk.id <= prev["last_id"])
+        .scalar()
+    )
+    if unchanged != n:
+        return None
+
+    new, new_ids, last_id = _load_embedding_rows(db, prev["last_id"])
+    if new is None:
+        return {**prev, "key": key}
+
+    ann = prev["ann"]
+    if ann is None and n + len(new_ids) >= ANN_MIN_CHUNKS:
+        return None
+    if ann is not None and not add_to_ann_index(ann, new, start=n):
+        return None
+
+    matrix, scales = prev["matrix"], prev["scales"]
+    if scales is not None:
+        new, new_scales = quantize_rows(new)
+        scales = np.concatenate([scales, new_scales])
+    matrix = np.vstack([matrix, new])
+
+    return {
+        "key": key,
+        "matrix": matrix,
+        "scales": scales,
+        "ann": ann,
+        "artifact_ids": np.concatenate([prev["artifact_ids"], new_ids]),
+        "last_id": last_id,
+    }
+
+
+def _get_embedding_index(db) -> dict:
+    global _EMBEDDING_CACHE
+
+    key = chunks_version(db)
+    cache = _EMBEDDING_CACHE
+    if cache["key"] == key:
+        return cache
+
+    with _EMBEDDING_LOCK:
+        # Another caller may have rebuilt while we waited
+        cache = _EMBEDDING_CACHE
+        if cache["key"] == key:
+            return cache
+
+        _backfill_embeddings(db)
+
+        cache = _extend_embedding_index(db, key, cache) or _build_embedding_index(db, key)
+        _EMBEDDING_CACHE = cache
+        return cache
+
+
+def _rank_by_embedding(index: dict, q: np.ndarray, k: int) -> List[int]:
+    artifact_ids = index["artifact_ids"]
+
+    if index["ann"] is not None:
+        # Only the TOP_CHUNKS nearest chunks are ever aggregated, so ask HNSW for those
+        rows, sims = ann_query(index["ann"], q, TOP_CHUNKS)
+        # The shared HNSW index may already hold rows appended after this snapshot
+        known = rows < len(artifact_ids)
+        return top_artifacts(sims[known], artifact_ids[rows[known]], k)
+
+    if index["scales"] is not None:
+        sims = int8_sim_matvec(index["matrix"], index["scales"], q)
+    else:
+        sims = cosine_sim_matvec(index["matrix"], q)
+    return top_artifacts(sims, artifact_ids, k)
+
+
 def embedding_retrieve(control_id: int, k: int = 10) -> List[int]:
     """
     Returns top-k artifact_ids by cosine similarity in embedding space.
     If the embedding model can't be loaded, returns [] (so hybrid falls back).
+    Chunk embeddings come from the DB; only the query is encoded per call.
     """
     model = _get_model()
     if model is None:
@@ -130,29 +432,41 @@ def embedding_retrieve(control_id: int, k: int = 10) -> List[int]:
         if not query:
             return []
 
-        chunks = load_chunks(db)
-        if not chunks:
+        index = _get_embedding_index(db)
+        if index["matrix"] is None:
             return []
 
-        chunk_texts = [t for _, _, t in chunks]
-
-        # Encode
-        chunk_emb = model.encode(chunk_texts, normalize_embeddings=True)
         q_emb = model.encode([query], normalize_embeddings=True)
+        return _rank_by_embedding(index, q_emb[0], k)
+    finally:
+        db.close()
 
-        sims = (chunk_emb @ q_emb[0]).flatten()
-        ranked = np.argsort(-sims)
 
-        # Aggregate chunk scores to artifact scores (max over chunks)
-        artifact_scores: Dict[int, float] = {}
-        top_n = min(len(ranked), 200)
-        for idx in ranked[:top_n]:
-            _, artifact_id, _ = chunks[idx]
-            score = float(sims[idx])
-            artifact_scores[artifact_id] = max(artifact_scores.get(artifact_id, 0.0), score)
+def embedding_retrieve_batch(control_ids: List[int], k: int = 10) -> Dict[int, List[int]]:
+    """
+    embedding_retrieve for many controls at once: all queries go through a
+    single model.encode call, then each is scored against the cached chunks.
+    """
+    out: Dict[int, List[int]] = {cid: [] for cid in control_ids}
+    model = _get_model()
+    if model is None:
+        return out
 
-        top = sorted(artifact_scores.items(), key=lambda x: x[1], reverse=True)[:k]
-        return [aid for aid, _ in top]
+    db = SessionLocal()
+    try:
+        queries = {cid: control_query_text(db, cid).strip() for cid in control_ids}
+        queries = {cid: q for cid, q in queries.items() if q}
+        if not queries:
+            return out
+
+        index = _get_embedding_index(db)
+        if index["matrix"] is None:
+            return out
+
+        q_embs = model.encode(list(queries.values()), batch_size=32, normalize_embeddings=True)
+        for cid, q in zip(queries, q_embs):
+            out[cid] = _rank_by_embedding(index, q, k)
+        return out
     finally:
         db.close()
 
@@ -166,8 +480,13 @@ def hybrid_retrieve(control_id: int, k: int = 10) -> List[int]:
     - pull lots from keyword + embedding
     - union them, keeping keyword order first, then embedding
     - take first k
+    Keyword results come first, so when they already fill k the embedding
+    branch can't change the answer and is skipped.
     """
     kw = keyword_retrieve(control_id, k=50)
+    if len(kw) >= k:
+        return kw[:k]
+
     em = embedding_retrieve(control_id, k=50)
 
     seen = set()
@@ -1,5 +1,6 @@
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from .db import SessionLocal, engine
+from .db import SessionLocal, engine, insert_ignore
 from .models import Base, Control, ChecklistItem
 
 
@@ -66,27 +67,24 @@ SEED_CHECKLIST = {
 
 
 def seed_controls(db: Session) -> None:
-    for item in SEED_CONTROLS:
-        exists = db.query(Control).filter(Control.code == item["code"]).first()
-        if not exists:
-            db.add(Control(**item))
+    # One multi-row INSERT; codes that already exist are skipped by the unique index
+    db.execute(insert_ignore(Control).values(SEED_CONTROLS))
     db.commit()
 
 
 def seed_checklist_items(db: Session) -> None:
-    for control in db.query(Control).all():
-        items = SEED_CHECKLIST.get(control.code, [])
-        for text in items:
-            exists = (
-                db.query(ChecklistItem)
-                .filter(
-                    ChecklistItem.control_id == control.id,
-                    ChecklistItem.text == text,
-                )
-                .first()
-            )
-            if not exists:
-                db.add(ChecklistItem(control_id=control.id, text=text, required=True))
+    code_to_id = dict(db.query(Control.code, Control.id).all())
+    existing = set(db.query(ChecklistItem.control_id, ChecklistItem.text).all())
+
+    rows = [
+        {"control_id": code_to_id[code], "text": text, "required": True}
+        for code, items in SEED_CHECKLIST.items()
+        if code in code_to_id
+        for text in items
+        if (code_to_id[code], text) not in existing
+    ]
+    if rows:
+        db.execute(insert(ChecklistItem), rows)
     db.commit()
 
 
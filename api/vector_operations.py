@@ -0,0 +1,97 @@
+# api/vector_operations.py
+#
+# Similarity kernels for precomputed, L2-normalized embeddings.
+# Plain NumPy/BLAS: safe to call from several threads at once (retrieval
+# runs under asyncio.to_thread in the report path).
+
+import numpy as np
+
+
+def cosine_sim_matvec(M: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of every row of M against q. Both sides must already
+    be L2-normalized, so this is just a dot product per row (BLAS gemv).
+    """
+    return M @ np.ascontiguousarray(q, dtype=M.dtype)
+
+
+# -----------------------------------------------------------------------------
+# int8 quantized rows (per-row scale): 4x less memory than float32
+# -----------------------------------------------------------------------------
+def quantize_rows(M: np.ndarray):
+    """
+    Symmetric per-row int8 quantization. Returns (M_q, scales) such that
+    M ~= M_q * scales[:, None].
+    """
+    scales = np.abs(M).max(axis=1).astype(np.float32) / 127.0
+    scales[scales == 0] = 1.0
+    M_q = np.round(M / scales[:, None]).astype(np.int8)
+    return M_q, scales
+
+
+def int8_sim_matvec(M_q: np.ndarray, scales: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    Approximate cosine similarity of quantized rows against a float query
+    (both sides L2-normalized before quantization). Dot products are
+    accumulated in int32 and rescaled once at the end.
+    """
+    q_scale = max(float(np.abs(q).max()) / 127.0, 1e-12)
+    q_q = np.round(q / q_scale).astype(np.int8)
+
+    # einsum widens int8 -> int32 on the fly instead of copying M_q
+    acc = np.einsum("ij,j->i", M_q, q_q.astype(np.int32))
+
+    return acc.astype(np.float32) * scales * np.float32(q_scale)
+
+
+# -----------------------------------------------------------------------------
+# Approximate nearest neighbours (hnswlib, optional)
+# -----------------------------------------------------------------------------
+try:
+    import hnswlib
+
+    HNSWLIB_AVAILABLE = True
+except ImportError:  # optional dependency
+    HNSWLIB_AVAILABLE = False
+
+
+def build_ann_index(
+    M: np.ndarray, ef_construction: int = 200, m: int = 16, ef: int = 256, headroom: float = 2.0
+):
+    """
+    HNSW index over the rows of M (cosine space), labelled by row position,
+    with room for headroom x as many rows so later chunks can be appended
+    with add_to_ann_index. Returns None when hnswlib isn't installed.
+    """
+    if not HNSWLIB_AVAILABLE:
+        return None
+
+    index = hnswlib.Index(space="cosine", dim=M.shape[1])
+    index.init_index(
+        max_elements=max(int(M.shape[0] * headroom), M.shape[0]),
+        ef_construction=ef_construction,
+        M=m,
+    )
+    index.add_items(M, np.arange(M.shape[0]))
+    index.set_ef(ef)
+    return index
+
+
+def add_to_ann_index(index, M: np.ndarray, start: int) -> bool:
+    """
+    Appends the rows of M labelled start, start+1, ... in place. Returns
+    False (index untouched) when they don't fit the preallocated capacity:
+    resize_index isn't safe while other threads query, so the caller
+    rebuilds instead. add_items itself can run alongside knn_query.
+    """
+    if start + M.shape[0] > index.get_max_elements():
+        return False
+    index.add_items(M, np.arange(start, start + M.shape[0]))
+    return True
+
+
+def ann_query(index, q: np.ndarray, k: int):
+    """Returns (row positions, cosine similarities) of the k nearest rows."""
+    k = min(k, index.get_current_count())
+    labels, distances = index.knn_query(q.reshape(1, -1), k=k)
+    return labels[0].astype(np.int64), 1.0 - distances[0]
@@ -1,50 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
 import pandas as pd
-from collections import defaultdict
 
-from api.retrieval import keyword_retrieve, embedding_retrieve, hybrid_retrieve
+from api.db import engine
+from api.retrieval import keyword_retrieve, embedding_retrieve_batch, hybrid_retrieve
 
 
 def precision_at_k(pred, rel_set, k):
-    top = pred[:k]
-    if not top:
+    top = np.asarray(pred[:k])
+    if top.size == 0:
         return 0.0
-    hits = sum(1 for a in top if a in rel_set)
-    return hits / k
+    return np.isin(top, list(rel_set)).sum() / k
 
 
 def recall_at_k(pred, rel_set, k):
     if not rel_set:
         return 0.0
-    top = pred[:k]
-    hits = sum(1 for a in top if a in rel_set)
-    return hits / len(rel_set)
+    top = np.asarray(pred[:k])
+    return np.isin(top, list(rel_set)).sum() / len(rel_set)
 
 
 def mrr(pred, rel_set):
-    for i, a in enumerate(pred, start=1):
-        if a in rel_set:
-            return 1.0 / i
-    return 0.0
+    mask = np.isin(np.asarray(pred), list(rel_set))
+    if not mask.any():
+        return 0.0
+    return 1.0 / (int(np.argmax(mask)) + 1)
+
+
+def _init_worker():
+    # Forked workers must not reuse the parent's pooled DB connections
+    engine.dispose(close=False)
+
+
+def predict_all(method_fn, control_ids, k=50):
+    """
+    Runs method_fn for every control across a process pool (EVAL_WORKERS,
+    default: all cores). The TF-IDF index is built (or loaded from the
+    api.build_tfidf snapshot) once in the parent before forking, so workers
+    inherit it copy-on-write instead of each refitting the corpus.
+    """
+    workers = min(int(os.getenv("EVAL_WORKERS", os.cpu_count() or 1)), len(control_ids))
+    if workers <= 1:
+        return [method_fn(cid, k=k) for cid in control_ids]
+
+    keyword_retrieve(control_ids[0], k=1)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+        return list(ex.map(partial(method_fn, k=k), control_ids))
+
 
+def run(method_name, method_fn, labels, k_p=5, k_r=10, batch=False):
+    relevant = labels[labels["relevance"].astype(int) >= 1]
+    control_to_rel = (
+        relevant.groupby(relevant["control_id"].astype(int))["artifact_id"]
+        .apply(lambda ids: set(ids.astype(int)))
+        .to_dict()
+    )
 
-def run(method_name, method_fn, labels, k_p=5, k_r=10):
-    control_to_rel = defaultdict(set)
-    for _, row in labels.iterrows():
-        if int(row["relevance"]) >= 1:
-            control_to_rel[int(row["control_id"])].add(int(row["artifact_id"]))
+    control_ids = list(control_to_rel)
+    if batch:
+        # One call for every control (e.g. a single batched query encode)
+        by_control = method_fn(control_ids, k=50)
+        preds = [by_control[cid] for cid in control_ids]
+    else:
+        preds = predict_all(method_fn, control_ids, k=50)
 
     p_scores, r_scores, mrr_scores = [], [], []
 
-    for control_id, rel_set in control_to_rel.items():
-        pred = method_fn(control_id, k=50)
+    for control_id, pred in zip(control_ids, preds):
+        rel_set = control_to_rel[control_id]
         p_scores.append(precision_at_k(pred, rel_set, k_p))
         r_scores.append(recall_at_k(pred, rel_set, k_r))
         mrr_scores.append(mrr(pred, rel_set))
 
     print(f"\n== {method_name} ==")
-    print(f"Precision@{k_p}: {sum(p_scores)/len(p_scores):.3f}")
-    print(f"Recall@{k_r}:    {sum(r_scores)/len(r_scores):.3f}")
-    print(f"MRR:             {sum(mrr_scores)/len(mrr_scores):.3f}")
+    print(f"Precision@{k_p}: {np.mean(p_scores):.3f}")
+    print(f"Recall@{k_r}:    {np.mean(r_scores):.3f}")
+    print(f"MRR:             {np.mean(mrr_scores):.3f}")
 
 
 def main():
@@ -56,7 +91,7 @@ def main():
         return
 
     run("Keyword (TF-IDF)", keyword_retrieve, labels)
-    run("Embedding (MiniLM)", embedding_retrieve, labels)
+    run("Embedding (MiniLM)", embedding_retrieve_batch, labels, batch=True)
     run("Hybrid (union)", hybrid_retrieve, labels)
 
 